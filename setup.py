@@ -28,5 +28,7 @@ setuptools.setup(
         'pandas',
         'torch',
         'tables',
+        'pyarrow',
+        'msgpack',
     ],
 )
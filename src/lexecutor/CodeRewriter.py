@@ -128,9 +128,9 @@ class CodeRewriter(cst.CSTTransformer):
         new_body = cst.IndentedBlock(body=body_content)
         return updated_node.with_changes(body=new_body)
         
-    def __create_import(self, name):
+    def __create_import(self, name, module="Runtime"):
         module_name = cst.Attribute(value=cst.Name(
-            value="lexecutor"), attr=cst.Name(value="Runtime"))
+            value="lexecutor"), attr=cst.Name(value=module))
         fct_name = cst.Name(value=name)
         imp_alias = cst.ImportAlias(name=fct_name)
         imp = cst.ImportFrom(module=module_name, names=[imp_alias])
@@ -371,13 +371,18 @@ class CodeRewriter(cst.CSTTransformer):
                 target_idx = i + 1
             
         # add our imports
-        import_n = self.__create_import("_n_")
-        import_a = self.__create_import("_a_")
-        import_c = self.__create_import("_c_")
-        import_l = self.__create_import("_l_")
+        if self.line_coverage_instrumentation:
+            # only _l_ calls are inserted, so use the coverage-only runtime
+            imports = [self.__create_import("_l_", module="CoverageRuntime")]
+        else:
+            import_n = self.__create_import("_n_")
+            import_a = self.__create_import("_a_")
+            import_c = self.__create_import("_c_")
+            import_l = self.__create_import("_l_")
+            imports = [import_n, import_a, import_c, import_l]
 
         new_body = (list(new_body[:target_idx])
-                    + [import_n, import_a, import_c, import_l]
+                    + imports
                     + list(new_body[target_idx:]))
 
         return updated_node.with_changes(body=new_body)
@@ -0,0 +1,145 @@
+from array import array
+import re
+
+
+# matches the iids of the hooks inserted by CodeRewriter, e.g., _n_(23, ...)
+hook_iid_regexp = re.compile(rb"\b_[nacl]_\((\d+)")
+
+
+class Coverage:
+    # Coverage of an execution, indexed by iid: a byte per iid that tells
+    # whether the iid was covered, and a hit counter per iid of a line (i.e.,
+    # of an _l_ call). Both cover a window of iids that starts at first_iid,
+    # which is preallocated for the iids of the executed file (see for_file)
+    # and grows only for other iids, e.g., of other instrumented modules.
+    # Only covered iids and lines that were hit are stored.
+    # numpy is imported only to merge and store coverage, so that runtimes
+    # don't pay for importing it at startup.
+
+    def __init__(self, first_iid=0, nb_iids=0):
+        self.first_iid = first_iid
+        self.covered = bytearray(nb_iids)
+        self.line_hits = array("I", bytes(4 * nb_iids))
+
+    @staticmethod
+    def for_file(file_path):
+        # sized to the iids of the hooks in the instrumented file
+        try:
+            with open(file_path, "rb") as fp:
+                iids = [int(iid) for iid in hook_iid_regexp.findall(fp.read())]
+        except OSError:
+            iids = []
+        if len(iids) == 0:
+            return Coverage()
+        return Coverage(min(iids), max(iids) + 1 - min(iids))
+
+    def index(self, iid):
+        # the index of iid in the window, which grows to include it if needed
+        if len(self.covered) == 0:
+            self.first_iid = iid
+        if iid < self.first_iid:
+            nb_new = self.first_iid - iid
+            self.covered[0:0] = bytes(nb_new)
+            self.line_hits[0:0] = array("I", bytes(4 * nb_new))
+            self.first_iid = iid
+        elif iid >= self.first_iid + len(self.covered):
+            nb_new = max(len(self.covered),
+                         iid + 1 - self.first_iid - len(self.covered))
+            self.covered.extend(bytes(nb_new))
+            self.line_hits.extend(array("I", bytes(4 * nb_new)))
+        return iid - self.first_iid
+
+    def cover_iid(self, iid):
+        idx = iid - self.first_iid
+        if not 0 <= idx < len(self.covered):
+            idx = self.index(iid)
+        self.covered[idx] = 1
+
+    def cover_line(self, iid):
+        idx = iid - self.first_iid
+        if not 0 <= idx < len(self.line_hits):
+            idx = self.index(iid)
+        self.line_hits[idx] += 1
+
+    def covered_iids(self):
+        return self.covered.count(1)
+
+    def executed_lines(self):
+        return sum(self.line_hits)
+
+    def covered_lines(self):
+        return len(self.line_hits) - self.line_hits.count(0)
+
+    def merge(self, other):
+        # covered iids are OR-ed, line hits are added up
+        import numpy as np
+        if len(other.covered) == 0:
+            return
+        self.index(other.first_iid)
+        self.index(other.first_iid + len(other.covered) - 1)
+        start = other.first_iid - self.first_iid
+        end = start + len(other.covered)
+        covered = np.frombuffer(self.covered, dtype=np.uint8)
+        covered[start:end] |= np.frombuffer(other.covered, dtype=np.uint8)
+        line_hits = np.frombuffer(self.line_hits, dtype=np.uint32)
+        line_hits[start:end] += np.frombuffer(other.line_hits, dtype=np.uint32)
+        del covered, line_hits  # release the buffers, so that the window can grow again
+
+    def save(self, file_path):
+        # stores only the covered iids, and the iids and hit counts of lines that were hit
+        import numpy as np
+        covered = np.frombuffer(self.covered, dtype=np.uint8)
+        line_hits = np.frombuffer(self.line_hits, dtype=np.uint32)
+        hit_idxs = np.flatnonzero(line_hits)
+        np.savez_compressed(file_path,
+                            covered_iids=np.flatnonzero(
+                                covered).astype(np.int64) + self.first_iid,
+                            line_iids=hit_idxs.astype(
+                                np.int64) + self.first_iid,
+                            line_hits=line_hits[hit_idxs])
+
+    @staticmethod
+    def load(file_path):
+        import numpy as np
+        data = np.load(file_path)
+        covered_iids, line_iids = data["covered_iids"], data["line_iids"]
+        all_iids = np.concatenate([covered_iids, line_iids])
+        if len(all_iids) == 0:
+            return Coverage()
+        first_iid = int(all_iids.min())
+        coverage = Coverage(first_iid, int(all_iids.max()) + 1 - first_iid)
+        covered = np.frombuffer(coverage.covered, dtype=np.uint8)
+        covered[covered_iids - first_iid] = 1
+        line_hits = np.frombuffer(coverage.line_hits, dtype=np.uint32)
+        line_hits[line_iids - first_iid] = data["line_hits"]
+        del covered, line_hits
+        return coverage
+
+
+def merge_coverage_files(file_paths):
+    # the coverage of several executions, e.g., of multiple runs of a file
+    merged = Coverage()
+    for file_path in file_paths:
+        merged.merge(Coverage.load(file_path))
+    return merged
+
+
+if __name__ == "__main__":
+    # merge coverage files, e.g., the coverage_<file>_<execution>.npz files
+    # written by RuntimeStats for several executions of a file
+    import argparse
+    from .Util import gather_files
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--files", help="Coverage .npz files or .txt file(s) with all coverage file paths", nargs="+", required=True)
+    parser.add_argument(
+        "--output", help="File to store the merged coverage in")
+    args = parser.parse_args()
+
+    merged = merge_coverage_files(gather_files(args.files, suffix=".npz"))
+    print(f"Covered iids: {merged.covered_iids()}")
+    print(f"Covered lines: {merged.covered_lines()}")
+    print(f"Executed lines: {merged.executed_lines()}")
+    if args.output is not None:
+        merged.save(args.output)
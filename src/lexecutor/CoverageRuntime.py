@@ -0,0 +1,47 @@
+import atexit
+import time
+from .Hyperparams import Hyperparams as params
+from .RuntimeStats import RuntimeStats, executed_file_and_execution
+from .Util import run_exit_handlers_on_sigterm
+from .Logging import logger
+
+
+# Runtime for files instrumented with --line_coverage_instrumentation, which
+# contain only _l_ calls: counts how often each line executes, without loading
+# any predictor, and saves the same metrics record (and coverage file next to
+# it) as Runtime does in PREDICT mode once at exit. As nothing gets injected,
+# the metrics are recorded for the AsIs predictor, or for PynguinTests when
+# running tests.
+
+file, execution = executed_file_and_execution()
+predictor_name = "PynguinTests" if params.file_type == "TESTE" else "AsIs"
+start_time = time.time()
+
+runtime_stats = RuntimeStats(execution, file, event_trace=False)
+coverage = runtime_stats.coverage
+line_hits = coverage.line_hits
+first_iid = coverage.first_iid
+
+
+def _save():
+    runtime_stats.save(file, predictor_name, start_time)
+    logger.info(
+        f"Covered {coverage.covered_lines()} lines, executed {coverage.executed_lines()} lines")
+
+
+atexit.register(_save)
+run_exit_handlers_on_sigterm()
+
+
+def _l_(iid):
+    global first_iid
+    idx = iid - first_iid
+    if idx >= 0:
+        try:
+            line_hits[idx] += 1
+            return
+        except IndexError:
+            pass
+    # an iid outside of the file's iids
+    coverage.cover_line(iid)
+    first_iid = coverage.first_iid
@@ -1,3 +1,8 @@
+import os
+from os import path
+import tempfile
+
+
 class Hyperparams(object):
     iids_file = "iids.json"
     verbose = False
@@ -11,6 +16,15 @@ class Hyperparams(object):
     # split = "file"
     split = "mixed"
 
+    # number of trace entries that RECORD mode buffers before writing them
+    trace_chunk_size = 100000
+    # binary trace of all events, written in RECORD mode (if enabled) next to the
+    # executed program, as <program>.trace.bin, and read in REPLAY mode
+    write_replay_trace = False
+    # seconds between intermediate saves of the runtime stats in PREDICT mode
+    # (they are always saved at exit)
+    runtime_stats_save_interval = 5
+
     value_abstraction = "fine-grained"
     # value_abstraction = "coarse-grained-deterministic"
     # value_abstraction = "coarse-grained-randomized"
@@ -19,6 +33,25 @@ class Hyperparams(object):
 
     # CodeT5 model
     max_output_length = 8
+    # fine-tuning supervises only the first label ids of each value
+    nb_trained_label_ids = 6
+    # maximum number of (input, candidate value) pairs that the candidate
+    # scorer passes through the decoder at once
+    max_scored_pairs = 256
+    # how the model server runs CodeT5: "pytorch", "pytorch-int8", "onnx",
+    # or "onnx-int8" (see predictors/codet5/InferenceBackend.py)
+    codet5_backend = "pytorch"
+    # absolute, so that all processes find the same server, whatever their working directory
+    model_server_socket = path.join(
+        tempfile.gettempdir(), f"lexecutor_model_server_{os.getuid()}.sock")
+    # micro-batching of concurrent queries in the model server
+    batch_window_ms = 5
+    batch_max_items = 50
+
+    # directory of the on-disk cache of model predictions (None to disable)
+    prediction_cache_dir = "prediction_cache"
+    # predict values for all iids of a file in batches before executing it
+    prefetch_predictions = True
 
     # feedforward model
     token_emb_len = 100
@@ -29,6 +62,13 @@ class Hyperparams(object):
 
     # training
     epochs = 10
+    # for sharded tensors (see PrepareData --shard_size): number of rows to
+    # shuffle across and number of DataLoader processes that read shards
+    shuffle_buffer_size = 10000
+    data_loader_workers = 4
+    # CodeT5 batches hold inputs of similar length, which are drawn from
+    # pools of this many batches
+    length_bucket_pool_batches = 100
     # CodeT5
     batch_size_CodeT5 = 50
     # CodeBERT
@@ -38,5 +78,9 @@ class Hyperparams(object):
     dataset = "so_snippets"
     # dataset = "random_functions"
     number_executions = 10
+    # how RunExperiments runs the files: "SOURCE" (python <file> <execution>)
+    # or "TESTE" (pytest <test file> <execution>, e.g., for Pynguin tests)
+    file_type = "SOURCE"
+    # file_type = "TESTE"
 
     
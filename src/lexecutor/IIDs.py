@@ -1,44 +1,336 @@
+from array import array
+from bisect import bisect_right
 from collections import namedtuple
+import argparse
+import mmap
 import os
 from os import path
 import json
+import struct
 from .Logging import logger
 
 
 Location = namedtuple(
     "Location", ["file", "line", "column_start", "column_end"])
 
+# Binary iid files start with a header (magic, first iid, next iid, number of
+# files, size of the file-name table), followed by the file names
+# (NUL-separated, padded to 4 bytes) and four int32 columns indexed by
+# iid - first iid: file id, line, column start, and column end.
+# Iids without a location have file id -1.
+magic = b"LXID\x02\x00\x00\x00"
+header = struct.Struct("<iiii")
+column_names = ["file_ids", "lines", "column_starts", "column_ends"]
+
+# granularities of sharded iid files
+shard_keys = {
+    "file": lambda file: file,
+    "directory": lambda file: path.dirname(file),
+}
+
+
+def binary_file_of(file_path):
+    # the binary companion of a JSON iid file
+    return file_path + ".bin"
+
+
+def shard_dir_of(manifest_path):
+    return manifest_path + ".shards"
+
+
+def _is_binary(file_path):
+    with open(file_path, "rb") as file:
+        return file.read(len(magic)) == magic
+
 
 class IIDs:
-    def __init__(self, file_path):
-        if not path.exists(file_path):
-            logger.info(f"Creating new iid file at {file_path}")
-            self.next_iid = 1
-            self._iid_to_location = {}
-        else:
-            with open(file_path, "r") as file:
-                json_object = json.load(file)
-            self.next_iid = json_object["next_iid"]
-            self._iid_to_location = json_object["iid_to_location"]
+    # Columnar table from iids to locations: an interned table of file names
+    # plus one int32 array per location field, indexed directly by iid.
+    # Binary iid files are memory-mapped, so loading them is near-instant.
+    # JSON iid files are still supported; storing one also writes its binary
+    # companion, which is preferred when loading as long as it is up to date.
+    #
+    # With shard_by, the iids are instead split into binary shards (one per
+    # source file or directory), and the iid file is a small JSON manifest
+    # with the iid range of each shard. Shards are loaded only once one of
+    # their iids is looked up.
+
+    def __init__(self, file_path, shard_by=None, first_iid=1):
         self.file_path = file_path
+        self._mm = None
+        self.shard_by = None
+        self.shards = []  # [first iid, last iid, shard file, key] of each shard
+        self._shard_first_iids = []
+        self._loaded_shards = {}
+        # file_path=None creates an in-memory table that isn't stored, and
+        # whose iids start at first_iid
+        if file_path is None or not path.exists(file_path):
+            if file_path is not None:
+                logger.info(f"Creating new iid file at {file_path}")
+            self._init_empty(first_iid)
+            self.shard_by = shard_by
+        elif _is_binary(file_path):
+            self._load_binary(file_path)
+        else:
+            binary_file = binary_file_of(file_path)
+            if path.exists(binary_file) and path.getmtime(binary_file) >= path.getmtime(file_path) \
+                    and _is_binary(binary_file):
+                self._load_binary(binary_file)
+            else:
+                with open(file_path, "r") as file:
+                    json_object = json.load(file)
+                if "shards" in json_object:
+                    self._load_manifest(json_object)
+                else:
+                    self._load_json(json_object)
+
+        if shard_by is not None and shard_by != self.shard_by:
+            if self.shard_by is not None:
+                raise ValueError(
+                    f"{file_path} is sharded by {self.shard_by}, not by {shard_by} -- reshard it with python -m lexecutor.IIDs")
+            # the iids of a monolithic file are moved into shards when storing it
+            logger.info(f"Converting {file_path} into shards by {shard_by}")
+            self.shard_by = shard_by
+
+    def _init_empty(self, first_iid=1):
+        self.first_iid = first_iid
+        self.next_iid = first_iid
+        self.files = []
+        self.file_to_id = {}
+        self.file_ids = array("i")
+        self.lines = array("i")
+        self.column_starts = array("i")
+        self.column_ends = array("i")
+
+    def _load_json(self, json_object):
+        self._init_empty()
+        nb_iids = json_object["next_iid"] - 1
+        self.file_ids.extend([-1] * nb_iids)
+        for column in [self.lines, self.column_starts, self.column_ends]:
+            column.extend([0] * nb_iids)
+        for iid, (file, line, column_start, column_end) in json_object["iid_to_location"].items():
+            idx = int(iid) - 1
+            self.file_ids[idx] = self._intern(file)
+            self.lines[idx] = line
+            self.column_starts[idx] = column_start
+            self.column_ends[idx] = column_end
+        self.next_iid = json_object["next_iid"]
+
+    def _load_binary(self, file_path):
+        with open(file_path, "rb") as file:
+            self._mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        offset = len(magic)
+        self.first_iid, self.next_iid, nb_files, files_size = header.unpack_from(
+            self._mm, offset)
+        offset += header.size
+        self.files = self._mm[offset:offset + files_size].decode(
+        ).split("\0") if nb_files > 0 else []
+        self.file_to_id = {file: file_id for file_id,
+                           file in enumerate(self.files)}
+        offset += files_size + (-files_size % 4)
+        column_size = 4 * (self.next_iid - self.first_iid)
+        for column_name in column_names:
+            column = memoryview(self._mm)[
+                offset:offset + column_size].cast("i")
+            setattr(self, column_name, column)
+            offset += column_size
+
+    def _load_manifest(self, json_object):
+        # iids that aren't in any shard yet are kept in this table's own columns
+        self._init_empty(json_object["next_iid"])
+        self.shard_by = json_object["shard_by"]
+        self.shards = json_object["shards"]
+        self._shard_first_iids = [shard[0] for shard in self.shards]
+
+    def _intern(self, file):
+        file_id = self.file_to_id.get(file)
+        if file_id is None:
+            file_id = len(self.files)
+            self.files.append(file)
+            self.file_to_id[file] = file_id
+        return file_id
+
+    def _make_mutable(self):
+        # copy memory-mapped columns into arrays before adding iids
+        for column_name in column_names:
+            setattr(self, column_name, array(
+                "i", getattr(self, column_name)))
+        self._mm = None
 
     def new(self, file, line, column_start, column_end):
-        self._iid_to_location[self.next_iid] = Location(
-            file, line, column_start, column_end)
+        return self._append(self._intern(file), line, column_start, column_end)
+
+    def _append(self, file_id, line, column_start, column_end):
+        if self._mm is not None:
+            self._make_mutable()
+        self.file_ids.append(file_id)
+        self.lines.append(line)
+        self.column_starts.append(column_start)
+        self.column_ends.append(column_end)
         self.next_iid += 1
         return self.next_iid - 1
 
+    def copy_to(self, other):
+        # appends all iids of this table to an empty table, keeping their numbers
+        for iid in range(1, self.next_iid):
+            try:
+                other.new(*self.location(iid))
+            except KeyError:
+                other._append(-1, 0, 0, 0)
+
     def store(self):
+        if self.shard_by is not None:
+            self.store_shards()
+        elif path.exists(self.file_path) and _is_binary(self.file_path):
+            self.store_binary(self.file_path)
+        else:
+            self.store_json(self.file_path)
+            self.store_binary(binary_file_of(self.file_path))
+
+    def store_json(self, file_path):
         all_data = {
             "next_iid": self.next_iid,
-            "iid_to_location": self._iid_to_location,
+            "iid_to_location": {iid: list(self.location(iid)) for iid in self.iids()},
         }
         json_object = json.dumps(all_data, indent=2)
-        with open(self.file_path, "w") as file:
+        with open(file_path, "w") as file:
             file.write(json_object)
 
+    def store_binary(self, file_path, first_iid=None, next_iid=None):
+        # stores the iids in [first_iid, next_iid) of this table's own columns
+        first_iid = self.first_iid if first_iid is None else first_iid
+        next_iid = self.next_iid if next_iid is None else next_iid
+        start, end = first_iid - self.first_iid, next_iid - self.first_iid
+
+        file_ids = self.file_ids[start:end]
+        # the file-name table of a slice only contains the files it refers to
+        used_file_ids = sorted(set(file_ids) - {-1})
+        files = [self.files[file_id] for file_id in used_file_ids]
+        if used_file_ids != list(range(len(self.files))):
+            old_to_new = {old: new for new, old in enumerate(used_file_ids)}
+            old_to_new[-1] = -1
+            file_ids = array("i", [old_to_new[file_id]
+                             for file_id in file_ids])
+        files_bytes = "\0".join(files).encode()
+
+        # write to a temporary file, so that memory-mapped readers of the old file aren't affected
+        tmp_file_path = file_path + ".tmp"
+        with open(tmp_file_path, "wb") as file:
+            file.write(magic)
+            file.write(header.pack(first_iid, next_iid,
+                       len(files), len(files_bytes)))
+            file.write(files_bytes)
+            file.write(b"\0" * (-len(files_bytes) % 4))
+            file.write(file_ids)
+            for column in [self.lines, self.column_starts, self.column_ends]:
+                file.write(column[start:end])
+        os.replace(tmp_file_path, file_path)
+
+    def store_shards(self):
+        # moves all iids that aren't in a shard yet into new shards, one per
+        # run of consecutive iids with the same shard key, and updates the manifest
+        shard_dir = shard_dir_of(self.file_path)
+        os.makedirs(shard_dir, exist_ok=True)
+        key_of = shard_keys[self.shard_by]
+        run_first_iid = None
+        run_key = None
+        for iid in range(self.first_iid, self.next_iid + 1):
+            if iid < self.next_iid:
+                file_id = self.file_ids[iid - self.first_iid]
+                key = key_of(self.files[file_id]) if file_id >= 0 else run_key
+            if run_first_iid is not None and (iid == self.next_iid or key != run_key):
+                shard_file = f"{run_first_iid}-{iid - 1}.bin"
+                self.store_binary(path.join(shard_dir, shard_file),
+                                  run_first_iid, iid)
+                self.shards.append([run_first_iid, iid - 1, shard_file, run_key])
+                self._shard_first_iids.append(run_first_iid)
+                run_first_iid = None
+            if run_first_iid is None:
+                run_first_iid, run_key = iid, key
+
+        manifest = {
+            "next_iid": self.next_iid,
+            "shard_by": self.shard_by,
+            "shards": self.shards,
+        }
+        tmp_file_path = self.file_path + ".tmp"
+        with open(tmp_file_path, "w") as file:
+            json.dump(manifest, file, indent=2)
+        os.replace(tmp_file_path, self.file_path)
+        # the binary companion of a file that got converted into shards is outdated
+        if path.exists(binary_file_of(self.file_path)):
+            os.remove(binary_file_of(self.file_path))
+        self._init_empty(self.next_iid)
+
+    def _shard(self, iid):
+        # the (lazily loaded) shard that contains the iid
+        shard_idx = bisect_right(self._shard_first_iids, iid) - 1
+        if shard_idx < 0 or iid > self.shards[shard_idx][1]:
+            raise KeyError(iid)
+        shard = self._loaded_shards.get(shard_idx)
+        if shard is None:
+            shard = IIDs(path.join(shard_dir_of(
+                self.file_path), self.shards[shard_idx][2]))
+            self._loaded_shards[shard_idx] = shard
+        return shard
+
+    def iids(self):
+        # all iids that have a location, in increasing order
+        all_iids = []
+        for first_iid, _, _, _ in self.shards:
+            all_iids.extend(self._shard(first_iid).iids())
+        file_ids = self.file_ids
+        first_iid = self.first_iid
+        all_iids.extend(iid for iid in range(first_iid, self.next_iid)
+                        if file_ids[iid - first_iid] >= 0)
+        return all_iids
+
+    def locations(self):
+        # all locations, in the order of their iids
+        return [self.location(iid) for iid in self.iids()]
+
     def line(self, iid):
-        return self._iid_to_location[str(iid)][1]
+        iid = int(iid)
+        if iid < self.first_iid:
+            return self._shard(iid).line(iid)
+        if iid >= self.next_iid or self.file_ids[iid - self.first_iid] < 0:
+            raise KeyError(iid)
+        return self.lines[iid - self.first_iid]
 
     def location(self, iid):
-        return Location(*self._iid_to_location[str(iid)])
+        iid = int(iid)
+        if iid < self.first_iid:
+            return self._shard(iid).location(iid)
+        if iid >= self.next_iid:
+            raise KeyError(iid)
+        idx = iid - self.first_iid
+        file_id = self.file_ids[idx]
+        if file_id < 0:
+            raise KeyError(iid)
+        return Location(self.files[file_id], self.lines[idx], self.column_starts[idx], self.column_ends[idx])
+
+
+if __name__ == "__main__":
+    # convert between JSON, binary, and sharded iid files
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", help="iid file to read", required=True)
+    parser.add_argument("--output", help="iid file to write", required=True)
+    parser.add_argument(
+        "--format", help="Format of the output file", choices=["json", "binary", "sharded"], default="binary")
+    parser.add_argument(
+        "--shard_by", help="Granularity of shards", choices=list(shard_keys.keys()), default="directory")
+    args = parser.parse_args()
+
+    iids = IIDs(args.input)
+    if args.format == "json":
+        iids.store_json(args.output)
+    elif args.format == "binary":
+        all_iids = IIDs(None)
+        iids.copy_to(all_iids)
+        all_iids.store_binary(args.output)
+    else:
+        sharded_iids = IIDs(args.output, shard_by=args.shard_by)
+        iids.copy_to(sharded_iids)
+        sharded_iids.store()
+    logger.info(
+        f"Converted {len(iids.iids())} iids from {args.input} to {args.output}")
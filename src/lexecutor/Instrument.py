@@ -1,8 +1,10 @@
 import argparse
+import multiprocessing
 from os import path
 import libcst as cst
 from .CodeRewriter import CodeRewriter
 from .IIDs import IIDs
+from .InstrumentationCache import InstrumentationCache
 from .Util import gather_files
 import re
 from shutil import copyfile, move
@@ -21,6 +23,12 @@ parser.add_argument(
     "--validate", help="Validate syntactic correctness of the instrumented code (and skip a file if syntactically incorrect)", action="store_true")
 parser.add_argument(
     "--verbose", help="Print details, e.g., about exceptions during instrumentation", action="store_true")
+parser.add_argument(
+    "--jobs", help="Number of processes that instrument files in parallel", type=int, default=1)
+parser.add_argument(
+    "--shard_iids", help="Store the iids in shards, one per source file or directory, that are loaded lazily (converts an existing monolithic iid file)", choices=["file", "directory"])
+parser.add_argument(
+    "--cache_dir", help="Directory to cache instrumented code in, to quickly re-instrument unchanged files with the same iids")
 
 
 ignored_file_suffixes = [
@@ -48,25 +56,34 @@ def gather_accessed_names(ast_wrapper):
     return used_names
 
 
-def instrument_file(file_path, iids, line_coverage_instrumentation, validate):
+def parse_file(file_path):
+    # returns the file's AST and the names it accesses, or None if the file
+    # shouldn't be instrumented
     for suffix in ignored_file_suffixes:
         if file_path.endswith(suffix):
             print(f"{file_path} is on blacklist -- skipping it")
-            return
+            return None
 
     with open(file_path, "r") as file:
         src = file.read()
 
     if "LExecutor: DO NOT INSTRUMENT" in src:
         print(f"{file_path} is already instrumented -- skipping it")
-        return
+        return None
 
     ast = cst.parse_module(src)
     ast_wrapper = cst.metadata.MetadataWrapper(ast)
     accessed_names = gather_accessed_names(ast_wrapper)
+    return ast_wrapper, accessed_names
 
+
+def rewrite_ast(file_path, ast_wrapper, accessed_names, iids, line_coverage_instrumentation):
     code_rewriter = CodeRewriter(file_path, iids, line_coverage_instrumentation, accessed_names)
-    rewritten_ast = ast_wrapper.visit(code_rewriter)
+    return ast_wrapper.visit(code_rewriter)
+
+
+def generate_code(file_path, rewritten_ast, validate, verbose=False):
+    # returns the instrumented code, or None if it isn't valid
     rewritten_code = "# LExecutor: DO NOT INSTRUMENT\n\n" + rewritten_ast.code
 
     if validate:
@@ -74,10 +91,23 @@ def instrument_file(file_path, iids, line_coverage_instrumentation, validate):
             cst.parse_module(rewritten_code)
         except Exception as e:
             print(f"Error while validating {file_path}. Ignoring this file.")
-            if args.verbose:
+            if verbose:
                 print(e)
-            return
+            return None
+
+    return rewritten_code
+
+
+def rewrite_file(file_path, iids, line_coverage_instrumentation, validate, verbose=False):
+    # returns the instrumented code, or None if the file shouldn't be instrumented
+    parsed = parse_file(file_path)
+    if parsed is None:
+        return None
+    rewritten_ast = rewrite_ast(file_path, *parsed, iids, line_coverage_instrumentation)
+    return generate_code(file_path, rewritten_ast, validate, verbose)
+
 
+def write_instrumented_file(file_path, rewritten_code):
     copied_file_path = re.sub(r"\.py$", ".py.orig", file_path)
     copyfile(file_path, copied_file_path)
 
@@ -85,6 +115,132 @@ def instrument_file(file_path, iids, line_coverage_instrumentation, validate):
         file.write(rewritten_code)
 
 
+def instrument_file(file_path, iids, line_coverage_instrumentation, validate, cache=None):
+    first_iid = iids.next_iid
+    rewritten_code = rewrite_file(
+        file_path, iids, line_coverage_instrumentation, validate, args.verbose)
+    if rewritten_code is not None:
+        write_instrumented_file(file_path, rewritten_code)
+        if cache is not None:
+            cache_instrumented_file(
+                cache, file_path, rewritten_code, first_iid, iids.next_iid - 1)
+
+
+def instrument_file_from_cache(file_path, iids, cache):
+    # returns True if the file is unchanged and its cached instrumentation got restored
+    try:
+        with open(file_path, "r") as file:
+            src = file.read()
+    except OSError:
+        return False
+    rewritten_code = cache.lookup(file_path, src, iids)
+    if rewritten_code is None:
+        return False
+    write_instrumented_file(file_path, rewritten_code)
+    print(f"{file_path} is unchanged -- restored its instrumentation from cache")
+    return True
+
+
+def cache_instrumented_file(cache, file_path, rewritten_code, first_iid, last_iid):
+    with open(re.sub(r"\.py$", ".py.orig", file_path), "r") as file:
+        src = file.read()
+    cache.store(file_path, src, rewritten_code, first_iid, last_iid)
+
+
+def _print_error(file_path, e, verbose):
+    print(f"Error while instrumenting {file_path}. Ignoring this file.")
+    if verbose:
+        print(e)
+
+
+def _rewrite_ast_in_worker(file_path, line_coverage_instrumentation, verbose, first_iid):
+    # returns the rewritten AST (or None) and the iids it took, starting at first_iid
+    file_iids = IIDs(None, first_iid=first_iid)
+    rewritten_ast = None
+    try:
+        parsed = parse_file(file_path)
+        if parsed is not None:
+            rewritten_ast = rewrite_ast(
+                file_path, *parsed, file_iids, line_coverage_instrumentation)
+    except Exception as e:
+        _print_error(file_path, e, verbose)
+    # files that fail keep the iids they took, as in sequential instrumentation
+    return rewritten_ast, file_iids
+
+
+def count_iids_in_worker(job):
+    # first pass: the number of iids that instrumenting the file takes
+    file_path, line_coverage_instrumentation, validate, verbose = job
+    _, file_iids = _rewrite_ast_in_worker(
+        file_path, line_coverage_instrumentation, False, 1)
+    return file_iids.next_iid - 1
+
+
+def rewrite_file_in_worker(job, first_iid):
+    # second pass: instruments the file with the iids reserved for it
+    file_path, line_coverage_instrumentation, validate, verbose = job
+    print(f"Instrumenting {file_path}")
+    rewritten_ast, file_iids = _rewrite_ast_in_worker(
+        file_path, line_coverage_instrumentation, verbose, first_iid)
+    rewritten_code = None
+    if rewritten_ast is not None:
+        try:
+            rewritten_code = generate_code(
+                file_path, rewritten_ast, validate, verbose)
+        except Exception as e:
+            _print_error(file_path, e, verbose)
+    return rewritten_code, file_iids.locations(), file_iids.next_iid - first_iid
+
+
+def _instrument_file_from_cache_or_skip(file_path, iids, cache, verbose):
+    # returns True if the file needs no rewriting, i.e., it got restored from
+    # the cache or it fails, as in sequential instrumentation
+    try:
+        return instrument_file_from_cache(file_path, iids, cache)
+    except Exception as e:
+        _print_error(file_path, e, verbose)
+        return True
+
+
+def instrument_files_in_parallel(files, iids, line_coverage_instrumentation, validate, jobs, verbose, cache=None):
+    # Rewriting a file determines how many iids it takes, so each file is
+    # rewritten twice, both times in parallel: once to count its iids, which
+    # reserves a block of iids per file, in the order of files, and once to
+    # instrument it with its block. Files thus get the same iids as with
+    # sequential instrumentation, no matter how many processes are used.
+    if cache is not None:
+        files = [file_path for file_path in files
+                 if not _instrument_file_from_cache_or_skip(file_path, iids, cache, verbose)]
+
+    jobs_args = [(file_path, line_coverage_instrumentation, validate, verbose)
+                 for file_path in files]
+    with multiprocessing.Pool(jobs) as pool:
+        # a file is rewritten as soon as the iids of all files before it are counted
+        results = []
+        next_iid = iids.next_iid
+        for job_args, nb_iids in zip(jobs_args, pool.imap(count_iids_in_worker, jobs_args)):
+            results.append((next_iid, nb_iids, pool.apply_async(
+                rewrite_file_in_worker, (job_args, next_iid))))
+            next_iid += nb_iids
+
+        for file_path, (first_iid, nb_iids, result) in zip(files, results):
+            rewritten_code, locations, nb_taken_iids = result.get()
+            if nb_taken_iids != nb_iids:
+                raise RuntimeError(
+                    f"{file_path} took {nb_taken_iids} iids instead of the {nb_iids} reserved for it")
+            assert first_iid == iids.next_iid
+            for location in locations:
+                iids.new(*location)
+            if rewritten_code is not None:
+                try:
+                    write_instrumented_file(file_path, rewritten_code)
+                    if cache is not None:
+                        cache_instrumented_file(
+                            cache, file_path, rewritten_code, first_iid, iids.next_iid - 1)
+                except Exception as e:
+                    _print_error(file_path, e, verbose)
+
+
 def restore_file(file_path):
     orig_file_path = re.sub(r"\.py$", ".py.orig", file_path)
     if path.isfile(orig_file_path):
@@ -99,15 +255,23 @@ if __name__ == "__main__":
     files = gather_files(args.files)
     if not args.restore:
         print(f"Found {len(files)} file(s) to instrument")
-        iids = IIDs(args.iids)
-        for file_path in files:
-            try:
-                print(f"Instrumenting {file_path}")
-                instrument_file(file_path, iids, args.line_coverage_instrumentation, args.validate)
-            except Exception as e:
-                print(f"Error while instrumenting {file_path}. Ignoring this file.")
-                if args.verbose:
-                    print(e)
+        iids = IIDs(args.iids, shard_by=args.shard_iids)
+        cache = InstrumentationCache(args.cache_dir, args.line_coverage_instrumentation,
+                                     args.validate) if args.cache_dir is not None else None
+        if args.jobs > 1:
+            instrument_files_in_parallel(files, iids, args.line_coverage_instrumentation,
+                                         args.validate, args.jobs, args.verbose, cache)
+        else:
+            for file_path in files:
+                try:
+                    if cache is not None and instrument_file_from_cache(file_path, iids, cache):
+                        continue
+                    print(f"Instrumenting {file_path}")
+                    instrument_file(file_path, iids, args.line_coverage_instrumentation, args.validate, cache)
+                except Exception as e:
+                    print(f"Error while instrumenting {file_path}. Ignoring this file.")
+                    if args.verbose:
+                        print(e)
         iids.store()
     else:
         nb_restored = 0
@@ -0,0 +1,57 @@
+import hashlib
+import json
+import os
+from os import path
+from . import CodeRewriter
+
+
+def _rewriter_version():
+    # any change of the rewriter invalidates all cached instrumentations
+    with open(CodeRewriter.__file__, "rb") as file:
+        return hashlib.sha1(file.read()).hexdigest()
+
+
+class InstrumentationCache:
+    # Maps (file path, source hash, rewriter version, instrumentation flags) to the
+    # instrumented code and the range of iids it uses, so that unchanged files
+    # can be instrumented again without rewriting them and with the same iids.
+
+    def __init__(self, cache_dir, line_coverage_instrumentation, validate):
+        self.cache_dir = cache_dir
+        self.flags = f"{line_coverage_instrumentation}-{validate}"
+        self.rewriter_version = _rewriter_version()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _entry_path(self, file_path, src):
+        hasher = hashlib.sha1()
+        for part in [path.abspath(file_path), self.rewriter_version, self.flags]:
+            hasher.update(part.encode())
+            hasher.update(b"\0")
+        hasher.update(src.encode())
+        return path.join(self.cache_dir, f"{hasher.hexdigest()}.json")
+
+    def lookup(self, file_path, src, iids):
+        entry_path = self._entry_path(file_path, src)
+        if not path.exists(entry_path):
+            return None
+        with open(entry_path, "r") as file:
+            entry = json.load(file)
+
+        # the cached code is only valid if the iids file still has its iids
+        first_iid, last_iid = entry["first_iid"], entry["last_iid"]
+        if last_iid >= first_iid:
+            try:
+                if iids.location(first_iid).file != file_path or iids.location(last_iid).file != file_path:
+                    return None
+            except KeyError:
+                return None
+        return entry["code"]
+
+    def store(self, file_path, src, rewritten_code, first_iid, last_iid):
+        entry = {"first_iid": first_iid, "last_iid": last_iid,
+                 "code": rewritten_code}
+        entry_path = self._entry_path(file_path, src)
+        tmp_path = entry_path + ".tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(entry, file)
+        os.replace(tmp_path, entry_path)
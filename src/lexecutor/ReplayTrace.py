@@ -0,0 +1,63 @@
+import mmap
+import os
+import struct
+from .Logging import logger
+
+
+# Binary trace of all events of an execution, in execution order, for REPLAY mode.
+# After a short header, each event is a fixed-width record of the iid and the
+# code of the (fine-grained) abstract value, so that the i-th event is at a known
+# offset and can be decoded lazily from a memory-mapped file.
+magic = b"LXRT\x01\x00\x00\x00"
+record = struct.Struct("<IB")
+
+
+def replay_trace_file_of(program_file):
+    # the replay trace of the executions of a program
+    return program_file + ".trace.bin"
+
+
+class ReplayTraceWriter:
+    def __init__(self, file_path, buffer_size=1 << 20):
+        # written to a temporary file that replaces file_path when closed, so
+        # that concurrent executions of the same program don't interleave
+        self.tmp_file_path = f"{file_path}.{os.getpid()}.tmp"
+        self.file = open(self.tmp_file_path, "wb")
+        self.file.write(magic)
+        self.buffer = bytearray()
+        self.buffer_size = buffer_size
+        self.file_path = file_path
+        self.nb_events = 0
+
+    def append(self, iid, value_code):
+        self.buffer += record.pack(iid, value_code)
+        self.nb_events += 1
+        if len(self.buffer) >= self.buffer_size:
+            self.file.write(self.buffer)
+            self.buffer = bytearray()
+
+    def close(self):
+        self.file.write(self.buffer)
+        self.buffer = bytearray()
+        self.file.close()
+        os.replace(self.tmp_file_path, self.file_path)
+        logger.info(
+            f"Wrote {self.nb_events} events to replay trace {self.file_path}")
+
+
+class ReplayTrace:
+    def __init__(self, file_path):
+        with open(file_path, "rb") as file:
+            self.mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[:len(magic)] != magic:
+            raise Exception(f"{file_path} is not a replay trace")
+        self.nb_events = (len(self.mm) - len(magic)) // record.size
+
+    def __len__(self):
+        return self.nb_events
+
+    def __getitem__(self, idx):
+        # returns (iid, value code) of the idx-th event
+        if idx >= self.nb_events:
+            raise IndexError(f"Replay trace has only {self.nb_events} events")
+        return record.unpack_from(self.mm, len(magic) + idx * record.size)
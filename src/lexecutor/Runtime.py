@@ -4,8 +4,10 @@ import time
 from os import path
 from .Hyperparams import Hyperparams as params
 from .TraceWriter import TraceWriter
-from .ValueAbstraction import restore_value, DummyObject
-from .RuntimeStats import RuntimeStats
+from .ValueAbstraction import value_factory, code_to_value_factory, DummyObject
+from .ReplayTrace import ReplayTrace, replay_trace_file_of
+from .RuntimeStats import RuntimeStats, executed_file_and_execution
+from .Util import run_exit_handlers_on_sigterm
 from .Logging import logger
 
 
@@ -17,23 +19,16 @@ mode = "PREDICT"   # predict and inject values if missing in exeuction
 # mode = "REPLAY"  # replay a previously recorded trace (mostly for testing)
 # ------- end: select mode -------
 
-file_type = "SOURCE"
-# file_type = "TESTE"
-
 if mode == "RECORD":
-    trace = TraceWriter()
-    atexit.register(lambda: trace.write_to_file())
+    trace = TraceWriter(
+        replay_trace_file=replay_trace_file_of(sys.argv[0]) if params.write_replay_trace else None)
+    atexit.register(trace.close)
     runtime_stats = None
 elif mode == "PREDICT":
     # for running experiments
-    if file_type == "SOURCE":
-        file = sys.argv[0]
-        execution = sys.argv[1] if len(sys.argv) > 1 else ""
-    elif file_type == "TESTE":
-        file = sys.argv[1]
-        execution = sys.argv[2] if len(sys.argv) > 1 else ""
-    
-    runtime_stats = RuntimeStats(execution)
+    file, execution = executed_file_and_execution()
+
+    runtime_stats = RuntimeStats(execution, file)
     atexit.register(runtime_stats.print)
     
     # from .predictors.AsIs import AsIs
@@ -56,17 +51,34 @@ elif mode == "PREDICT":
 
     # from .predictors.Type4PyValuePredictor import Type4PyValuePredictor
     # predictor = Type4PyValuePredictor(file, runtime_stats)
+
+    if params.prefetch_predictions and params.file_type == "SOURCE" and hasattr(predictor, "prefetch"):
+        predictor.prefetch(file)
     
     start_time = time.time()
-    if file_type == "TESTE":
+    if params.file_type == "TESTE":
         predictor_name = "PynguinTests"
     else:
         predictor_name = predictor.__class__.__name__
         
     atexit.register(runtime_stats.save, file, predictor_name, start_time)
+    run_exit_handlers_on_sigterm()
 elif mode == "REPLAY":
-    with open("trace.out", "r") as file:
-        trace = file.readlines()
+    replay_trace_file = replay_trace_file_of(sys.argv[0])
+    # the binary trace is used unless the textual trace is more recent
+    if path.exists(replay_trace_file) and (not path.exists("trace.out")
+                                           or path.getmtime(replay_trace_file) >= path.getmtime("trace.out")):
+        # binary trace of (iid, value code) records, decoded lazily
+        trace = ReplayTrace(replay_trace_file)
+        trace_factories = code_to_value_factory
+    else:
+        # textual trace; resolve each line to the iid and the factory of its value once, upfront
+        trace = []
+        trace_factories = None
+        with open("trace.out", "r") as file:
+            for trace_line in file:
+                segments = trace_line.rstrip().split(" ")
+                trace.append((int(segments[0]), value_factory(segments[-1])))
     next_trace_idx = 0
     runtime_stats = None
 
@@ -76,159 +88,215 @@ logger.info(f"### LExecutor running in {mode} mode ###")
 kind_and_name_to_value = {}
 
 
-def _n_(iid, name, lambada):
+def _fct_name(fct):
+    fct_name = fct.__name__ if hasattr(fct, "__name__") else str(fct)
+    if " " in fct_name:  # some fcts that don't have a proper name
+        fct_name = fct_name.split(" ")[0]
+    return fct_name
+
+
+def _get_attribute(base, attr_name):
+    # return getattr(base, attr_name)
+    # unmangle private attributes (code copied from DynaPyt)
+    if (attr_name.startswith('__')) and (not attr_name.endswith('__')):
+        if type(base).__name__ == 'type':
+            parents = [base]
+        else:
+            parents = [type(base)]
+        found = True
+        while len(parents) > 0:
+            found = True
+            cur_par = parents.pop()
+            try:
+                cur_name = cur_par.__name__
+                cur_name = cur_name.lstrip('_')
+                return getattr(base, '_'+cur_name+attr_name)
+            except AttributeError:
+                found = False
+                parents.extend(list(cur_par.__bases__))
+                continue
+            break
+        if not found:
+            raise AttributeError()
+    else:
+        return getattr(base, attr_name)
+
+
+# ------- RECORD mode: perform the operation and append the value to the trace -------
+
+def _record_n_(iid, name, lambada):
     if params.verbose:
         logger.info(f"\nAt iid={iid}, looking up name '{name}'")
 
-    if runtime_stats is not None:
-        runtime_stats.total_uses += 1
-        runtime_stats.cover_iid(iid)
+    v = lambada()
+    trace.append_name(iid, name, v)
+    return v
+
 
-    perform_fct = lambada
+def _record_c_(iid, fct, *args, **kwargs):
+    if params.verbose:
+        logger.info(f"\nAt iid={iid}, calling function {fct}")
 
-    def record_fct(v):
-        trace.append_name(iid, name, v)
+    v = fct(*args, **kwargs)
+    trace.append_call(iid, fct, args, kwargs, v)
+    return v
+
+
+def _record_a_(iid, base, attr_name):
+    if params.verbose:
+        logger.info(f"\nAt iid={iid}, looking up attribute '{attr_name}'")
+
+    v = _get_attribute(base, attr_name)
+    trace.append_attribute(iid, base, attr_name, v)
+    return v
 
-    def predict_fct():
-        key = f"name#{name}"
-        if key in kind_and_name_to_value:
-            return kind_and_name_to_value[key]
-        else:
-            v = predictor.name(iid, name)
-            kind_and_name_to_value[key] = v
-            return v
 
-    return mode_branch(iid, perform_fct, record_fct, predict_fct, kind="name")
+# ------- PREDICT mode: perform the operation and intervene if a value is missing -------
 
+def _predict_name(iid, name):
+    key = f"name#{name}"
+    if key in kind_and_name_to_value:
+        return kind_and_name_to_value[key]
+    v = predictor.name(iid, name)
+    kind_and_name_to_value[key] = v
+    return v
 
-def _c_(iid, fct, *args, **kwargs):
+
+def _predict_call(iid, fct, args, kwargs):
+    fct_name = _fct_name(fct)
+    key = f"call#{fct_name}"
+    if key in kind_and_name_to_value:
+        return kind_and_name_to_value[key]
+    v = predictor.call(iid, fct, fct_name, args, kwargs)
+    kind_and_name_to_value[key] = v
+    return v
+
+
+def _predict_attribute(iid, base, attr_name):
+    key = f"attribute#{attr_name}"
+    if key in kind_and_name_to_value:
+        return kind_and_name_to_value[key]
+    v = predictor.attribute(iid, base, attr_name)
+    kind_and_name_to_value[key] = v
+    return v
+
+
+def _uncaught(iid, e):
     if params.verbose:
-        logger.info(f"\nAt iid={iid}, calling function {fct}")
+        logger.info(f"Exception '{type(e)}' not caught, re-raising")
+    runtime_stats.uncaught_exception(iid, e)
 
-    if runtime_stats is not None:
-        runtime_stats.total_uses += 1
-        runtime_stats.cover_iid(iid)
 
-    def perform_fct():
-        return fct(*args, **kwargs)
+def _predict_n_(iid, name, lambada):
+    if params.verbose:
+        logger.info(f"\nAt iid={iid}, looking up name '{name}'")
 
-    def record_fct(v):
-        trace.append_call(iid, fct, args, kwargs, v)
+    runtime_stats.total_uses += 1
+    runtime_stats.cover_iid(iid)
+
+    try:
+        v = lambada()
+    except Exception as e:
+        if type(e) != NameError:
+            _uncaught(iid, e)
+            raise
+        if params.verbose:
+            logger.info(
+                f"Catching '{type(e)}' during name and calling predictor instead")
+    else:
+        if params.verbose:
+            logger.info("Found/computed/returned regular value")
+        return v
+    v = _predict_name(iid, name)
+    runtime_stats.guided_uses += 1
+    return v
 
-    def predict_fct():
-        fct_name = fct.__name__ if hasattr(fct, "__name__") else str(fct)
-        if " " in fct_name:  # some fcts that don't have a proper name
-            fct_name = fct_name.split(" ")[0]
 
-        key = f"call#{fct_name}"
-        if key in kind_and_name_to_value:
-            return kind_and_name_to_value[key]
-        else:
-            v = predictor.call(iid, fct, fct_name, args, kwargs)
-            kind_and_name_to_value[key] = v
-            return v
+def _predict_c_(iid, fct, *args, **kwargs):
+    if params.verbose:
+        logger.info(f"\nAt iid={iid}, calling function {fct}")
+
+    runtime_stats.total_uses += 1
+    runtime_stats.cover_iid(iid)
+
+    if fct is DummyObject:
+        # predict and inject a return value
+        return _predict_call(iid, fct, args, kwargs)
 
-    kind = "call_dummy" if fct is DummyObject else "call"
-    return mode_branch(iid, perform_fct, record_fct, predict_fct, kind=kind)
+    try:
+        v = fct(*args, **kwargs)
+    except Exception as e:
+        _uncaught(iid, e)
+        raise
+    if params.verbose:
+        logger.info("Found/computed/returned regular value")
+    return v
 
 
-def _a_(iid, base, attr_name):
+def _predict_a_(iid, base, attr_name):
     if params.verbose:
         logger.info(f"\nAt iid={iid}, looking up attribute '{attr_name}'")
 
-    if runtime_stats is not None:
-        runtime_stats.total_uses += 1
-        runtime_stats.cover_iid(iid)
-
-    def perform_fct():
-        # return getattr(base, attr_name)
-        # unmangle private attributes (code copied from DynaPyt)
-        if (attr_name.startswith('__')) and (not attr_name.endswith('__')):
-            if type(base).__name__ == 'type':
-                parents = [base]
-            else:
-                parents = [type(base)]
-            found = True
-            while len(parents) > 0:
-                found = True
-                cur_par = parents.pop()
-                try:
-                    cur_name = cur_par.__name__
-                    cur_name = cur_name.lstrip('_')
-                    return getattr(base, '_'+cur_name+attr_name)
-                except AttributeError:
-                    found = False
-                    parents.extend(list(cur_par.__bases__))
-                    continue
-                break
-            if not found:
-                raise AttributeError()
-        else:
-            return getattr(base, attr_name)
+    runtime_stats.total_uses += 1
+    runtime_stats.cover_iid(iid)
+
+    try:
+        v = _get_attribute(base, attr_name)
+    except Exception as e:
+        if type(e) != AttributeError:
+            _uncaught(iid, e)
+            raise
+        if params.verbose:
+            logger.info(
+                f"Catching '{type(e)}' during attribute and calling predictor instead")
+    else:
+        if params.verbose:
+            logger.info("Found/computed/returned regular value")
+        return v
+    v = _predict_attribute(iid, base, attr_name)
+    runtime_stats.guided_uses += 1
+    return v
 
-    def record_fct(v):
-        trace.append_attribute(iid, base, attr_name, v)
 
-    def predict_fct():
-        key = f"attribute#{attr_name}"
-        if key in kind_and_name_to_value:
-            return kind_and_name_to_value[key]
-        else:
-            v = predictor.attribute(iid, base, attr_name)
-            kind_and_name_to_value[key] = v
-            return v
+# ------- REPLAY mode: inject the values of a previously recorded trace -------
+
+def _replay(iid):
+    global next_trace_idx
+    trace_iid, value = trace[next_trace_idx]
+    next_trace_idx += 1
+    if iid != trace_iid:
+        raise Exception(
+            f"trace_iid={trace_iid} doesn't match execution iid={iid}")
+    # binary traces store value codes, textual traces the value factories
+    factory = trace_factories[value] if trace_factories is not None else value
+    return factory()
+
+
+def _replay_n_(iid, name, lambada):
+    return _replay(iid)
+
+
+def _replay_c_(iid, fct, *args, **kwargs):
+    return _replay(iid)
+
+
+def _replay_a_(iid, base, attr_name):
+    return _replay(iid)
 
-    return mode_branch(iid, perform_fct, record_fct, predict_fct, kind="attribute")
 
 def _l_(iid):
     if runtime_stats is not None:
         runtime_stats.cover_line(iid)
-        runtime_stats.save(file, predictor_name, start_time)
+        runtime_stats.save_periodically(file, predictor_name, start_time)
 
-def mode_branch(iid, perform_fct, record_fct, predict_fct, kind):
-    if mode == "RECORD":
-        v = perform_fct()
-        record_fct(v)
-        return v
-    elif mode == "PREDICT":
-        if kind == "call_dummy":
-            # predict and inject a return value
-            v = predict_fct()
-            return v
-        else:
-            # try to perform the regular behavior and intervene in case of exceptions caused by missing values
-            try:
-                v = perform_fct()
-                if params.verbose:
-                    logger.info("Found/computed/returned regular value")
-                return v
-            except Exception as e:
-                if (type(e) == NameError and kind == "name") \
-                        or (type(e) == AttributeError and kind == "attribute"):
-                    if params.verbose:
-                        logger.info(
-                            f"Catching '{type(e)}' during {kind} and calling predictor instead")
-                    v = predict_fct()
-                    runtime_stats.guided_uses += 1
-                    return v
-                else:
-                    if params.verbose:
-                        logger.info(
-                            f"Exception '{type(e)}' not caught, re-raising")
-                    runtime_stats.uncaught_exception(iid, e)
-                    raise e
-    elif mode == "REPLAY":
-        # replay mode
-        global next_trace_idx
-        trace_line = trace[next_trace_idx].rstrip()
-        next_trace_idx += 1
-        segments = trace_line.split(" ")
-        trace_iid = int(segments[0])
-        abstract_value = segments[-1]
-        if iid != trace_iid:
-            raise Exception(
-                f"trace_iid={trace_iid} doesn't match execution iid={iid}")
-        v = restore_value(abstract_value)
-        return v
-    else:
-        raise Exception(f"Unexpected mode {mode}")
+
+# pick the hooks for the selected mode once, so that each event
+# directly runs the mode-specific code without any dispatching
+if mode == "RECORD":
+    _n_, _c_, _a_ = _record_n_, _record_c_, _record_a_
+elif mode == "PREDICT":
+    _n_, _c_, _a_ = _predict_n_, _predict_c_, _predict_a_
+elif mode == "REPLAY":
+    _n_, _c_, _a_ = _replay_n_, _replay_c_, _replay_a_
+else:
+    raise Exception(f"Unexpected mode {mode}")
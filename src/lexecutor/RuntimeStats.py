@@ -1,112 +1,136 @@
-import pandas as pd
+from array import array
+import json
 import os
-from os import path
-import csv
+import sys
 import time
 from .Logging import logger
 from .IIDs import IIDs
+from .Coverage import Coverage
 from .Hyperparams import Hyperparams as param
 
 write_event_trace = True
 write_metrics = True
 
+# codes of events in the event trace
+executed_event, inject_event, uncaught_event = 0, 1, 2
+
+
+def executed_file_and_execution():
+    # the executed file and the number of the execution, as passed by RunExperiments
+    if param.file_type == "TESTE":
+        # sys.argv[0] is pytest
+        return sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else ""
+    return sys.argv[0], sys.argv[1] if len(sys.argv) > 1 else ""
+
 
 class RuntimeStats:
-    def __init__(self, execution):
+    def __init__(self, execution, file, event_trace=None):
         self.total_uses = 0
         self.guided_uses = 0
 
-        self.covered_iids = set()
-        self.executed_lines = []
+        self.coverage = Coverage.for_file(file)
 
-        if write_event_trace:
-            self.event_trace = []
+        self.event_trace = write_event_trace if event_trace is None else event_trace
+        if self.event_trace:
             self.iids = IIDs(param.iids_file)
+            # (event code, iid) pairs, formatted only when the trace is saved;
+            # injections and uncaught exceptions also have a message each
+            self.event_codes = array("B")
+            self.event_iids = array("i")
+            self.event_messages = []
+
+        self.next_save_time = time.time() + param.runtime_stats_save_interval
 
         self.random_predictions = 0
         self.type4py_predictions = 0
 
         self.execution = execution
+        self.metrics_file = None
 
     def cover_iid(self, iid):
-        self.covered_iids.add(iid)
-        if write_event_trace:
-            self.event_trace.append(f"Line {self.iids.line(iid)}: Executed")
-            
+        self.coverage.cover_iid(iid)
+        if self.event_trace:
+            self.event_codes.append(executed_event)
+            self.event_iids.append(iid)
+
     def cover_line(self, iid):
-        self.executed_lines.append(iid)
-        logger.info(f"Line {self.iids.line(iid)}: Executed")
+        self.coverage.cover_line(iid)
 
     def inject_value(self, iid, msg):
-        if write_event_trace:
-            self.event_trace.append(
-                f"Line {self.iids.line(iid)}: {msg}")
+        if self.event_trace:
+            self.event_codes.append(inject_event)
+            self.event_iids.append(iid)
+            self.event_messages.append(msg)
 
     def uncaught_exception(self, iid, e):
-        if write_event_trace:
-            self.event_trace.append(
-                f"Line {self.iids.line(iid)}: Uncaught exception {type(e)}\n{e}")
+        if self.event_trace:
+            self.event_codes.append(uncaught_event)
+            self.event_iids.append(iid)
+            self.event_messages.append(f"Uncaught exception {type(e)}\n{e}")
 
     def print(self):
-        logger.info(f"Covered iids: {len(self.covered_iids)}")
+        logger.info(f"Covered iids: {self.coverage.covered_iids()}")
         logger.info(f"Total uses: {self.total_uses}")
         logger.info(f"Guided uses : {self.guided_uses}/{self.total_uses}")
 
+    def _open_metrics_files(self, file, predictor_name):
+        if param.dataset == "so_snippets":
+            project_name = ""
+            file_name = file.split("/")[2].split('.')[0]
+        else:
+            project_name = file.split("/")[2]
+            file_name = file.split("/")[4].split('.')[0]
+
+        # Create destination dir if it doesn't exist
+        metrics_dir = f'./metrics/{param.dataset}/{predictor_name}/raw'
+        os.makedirs(metrics_dir, exist_ok=True)
+
+        # one JSON record per line, appended on each save
+        self.metrics_file = open(f'{metrics_dir}/metrics_{project_name}_{file_name}_{self.execution}.jsonl', 'a')
+        # covered iids and line hits of several executions can be merged with merge_coverage_files
+        self.coverage_file = f'{metrics_dir}/coverage_{project_name}_{file_name}_{self.execution}.npz'
+
     def _save_summary_metrics(self, file, predictor_name, execution_time):
         if write_metrics:
-            if param.dataset == "so_snippets":
-                project_name = ""
-                file_name = file.split("/")[2].split('.')[0]
-            else:
-                project_name = file.split("/")[2]
-                file_name = file.split("/")[4].split('.')[0]
-
             if predictor_name == 'CodeT5ValuePredictor' or predictor_name == 'CodeBERTValuePredictor':
                 predictor_name = f'{predictor_name}_{param.value_abstraction}'
 
-            # Create destination dir if it doesn't exist
-            if not os.path.exists('./metrics'):
-                os.makedirs('./metrics')
-            if not os.path.exists(f'./metrics/{param.dataset}'):
-                os.makedirs(f'./metrics/{param.dataset}')
-            if not os.path.exists(f'./metrics/{param.dataset}/{predictor_name}'):
-                os.makedirs(f'./metrics/{param.dataset}/{predictor_name}')
-            if not os.path.exists(f'./metrics/{param.dataset}/{predictor_name}/raw'):
-                os.makedirs(f'./metrics/{param.dataset}/{predictor_name}/raw')
-
-            # Create CSV file and add header if it doesn't exist
-            if not os.path.isfile(f'./metrics/{param.dataset}/{predictor_name}/raw/metrics_{project_name}_{file_name}_{self.execution}.csv'):
-                columns = ['file', 'predictor', 'covered_iids',
-                        'total_uses', 'guided_uses', 'executed_lines', 
-                        'covered_lines', 'execution_time', 'random_predictions', 
-                        'type4py_predictions', 'execution']
-
-                with open(f'./metrics/{param.dataset}/{predictor_name}/raw/metrics_{project_name}_{file_name}_{self.execution}.csv', 'a') as csvFile:
-                    writer = csv.writer(csvFile)
-                    writer.writerow(columns)
-
-            df = pd.read_csv(f'./metrics/{param.dataset}/{predictor_name}/raw/metrics_{project_name}_{file_name}_{self.execution}.csv')
-            df_new_data = pd.DataFrame({
-                'file': [file],
-                'predictor': [predictor_name],
-                'covered_iids': [len(self.covered_iids)],
-                'total_uses': [self.total_uses],
-                'guided_uses': [self.guided_uses],
-                'executed_lines': [len(self.executed_lines)],
-                'covered_lines': [len(set(self.executed_lines))],
-                'execution_time': [execution_time],
-                'random_predictions': [self.random_predictions],
-                'type4py_predictions': [self.type4py_predictions],
-                'execution': [self.execution]
-            })
-            df = pd.concat([df, df_new_data])
-            df.to_csv(f'./metrics/{param.dataset}/{predictor_name}/raw/metrics_{project_name}_{file_name}_{self.execution}.csv', index=False)
+            if self.metrics_file is None:
+                self._open_metrics_files(file, predictor_name)
+
+            record = {
+                'file': file,
+                'predictor': predictor_name,
+                'covered_iids': self.coverage.covered_iids(),
+                'total_uses': self.total_uses,
+                'guided_uses': self.guided_uses,
+                'executed_lines': self.coverage.executed_lines(),
+                'covered_lines': self.coverage.covered_lines(),
+                'execution_time': execution_time,
+                'random_predictions': self.random_predictions,
+                'type4py_predictions': self.type4py_predictions,
+                'execution': self.execution
+            }
+            self.metrics_file.write(json.dumps(record) + "\n")
+            self.metrics_file.flush()
+            self.coverage.save(self.coverage_file)
 
     def _save_event_trace(self):
+        lines = []
+        messages = iter(self.event_messages)
+        for code, iid in zip(self.event_codes, self.event_iids):
+            msg = "Executed" if code == executed_event else next(messages)
+            lines.append(f"Line {self.iids.line(iid)}: {msg}")
         with open("trace.txt", "w") as fp:
-            fp.write("\n".join(self.event_trace))
+            fp.write("\n".join(lines))
 
     def save(self, file, predictor_name, start_time):
         self._save_summary_metrics(file, predictor_name, time.time() - start_time)
-        if write_event_trace:
+        if self.event_trace:
             self._save_event_trace()
+        self.next_save_time = time.time() + param.runtime_stats_save_interval
+
+    def save_periodically(self, file, predictor_name, start_time):
+        # saves intermediate results, in case the process gets killed
+        if time.time() >= self.next_save_time:
+            self.save(file, predictor_name, start_time)
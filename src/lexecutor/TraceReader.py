@@ -0,0 +1,26 @@
+import pandas as pd
+import pyarrow as pa
+
+
+def read_trace(trace_file):
+    # returns the entries of a trace file written by TraceWriter as a DataFrame
+    if trace_file.endswith(".h5"):
+        # traces written by earlier versions of TraceWriter
+        return pd.read_hdf(trace_file, key="entries")
+
+    with pa.OSFile(trace_file, "rb") as file:
+        reader = pa.ipc.open_stream(file)
+        batches = []
+        try:
+            for batch in reader:
+                batches.append(batch)
+        except pa.ArrowInvalid:
+            pass  # trace of a process that got killed while writing; keep the complete chunks
+        table = pa.Table.from_batches(batches, schema=reader.schema)
+
+    # decode the interned, integer-coded columns
+    df = table.to_pandas()
+    df["iid"] = df["iid"].astype("int")
+    for column in ["name", "value", "kind", "info"]:
+        df[column] = df[column].astype("str")
+    return df
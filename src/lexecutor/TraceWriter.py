@@ -1,52 +1,165 @@
-import pandas as pd
-from .ValueAbstraction import abstract_value
+from array import array
+import queue
+import threading
+import pyarrow as pa
+from .ValueAbstraction import abstract_value, abstract_values
+from .ReplayTrace import ReplayTraceWriter
+from .Hyperparams import Hyperparams as params
 from .Logging import logger
 from .Util import timestamp
 
 
 column_names = ["iid", "name", "value", "kind", "info"]
 
+# codes of the kinds of entries (indices into kinds)
+kinds = ["name", "call", "attribute"]
+name_kind, call_kind, attribute_kind = 0, 1, 2
+
+# entries are stored as integer columns; the string columns are
+# dictionary-encoded, so each distinct string is written once per file
+schema = pa.schema([
+    ("iid", pa.int32()),
+    ("name", pa.dictionary(pa.int32(), pa.string())),
+    ("value", pa.dictionary(pa.uint8(), pa.string())),
+    ("kind", pa.dictionary(pa.uint8(), pa.string())),
+    ("info", pa.dictionary(pa.int32(), pa.string())),
+])
+
+value_dictionary = pa.array(abstract_values, type=pa.string())
+kind_dictionary = pa.array(kinds, type=pa.string())
+
+
+def _to_arrow(values, type):
+    return pa.Array.from_buffers(type, len(values), [None, pa.py_buffer(values)])
+
 
 class TraceWriter:
-    def __init__(self):
-        self.buffer = []
+    # Streams deduplicated trace entries to an Arrow IPC file in chunks of
+    # a fixed size. Chunks are compressed and written by a background thread,
+    # so memory stays flat and the traced program doesn't wait for the disk.
+
+    def __init__(self, chunk_size=params.trace_chunk_size, replay_trace_file=None):
+        self.file_name = f"trace_{timestamp()}.arrow"
+        self.chunk_size = chunk_size
+        # optionally, also record every event in order for REPLAY mode
+        self.replay_writer = ReplayTraceWriter(
+            replay_trace_file) if replay_trace_file is not None else None
+        self._new_buffer()
+        self.seen_entries = set()  # (iid, name_id, value, kind) already written
+        self.nb_duplicates = 0
+
+        # interned strings; ids are indices into these lists
+        self.names = []
+        self.name_to_id = {}
+        self.infos = []
+        self.info_to_id = {}
+
+        # at most two chunks wait for the writer thread, which bounds memory
+        self.chunks = queue.Queue(maxsize=2)
+        self.writer_thread = threading.Thread(
+            target=self._write_chunks, daemon=True)
+        self.writer_thread.start()
+
+    def _new_buffer(self):
+        self.iids = array("i")
+        self.name_ids = array("i")
+        self.values = array("B")
+        self.kinds = array("B")
+        self.info_ids = array("i")
 
     def _append(self, iid, name, raw_value, kind):
         value, info = abstract_value(raw_value)
-        self.buffer.append([iid, name, value, kind, info])
+        if self.replay_writer is not None:
+            self.replay_writer.append(iid, value)
+
+        name_id = self.name_to_id.get(name)
+        if name_id is None:
+            name_id = len(self.names)
+            self.names.append(name)
+            self.name_to_id[name] = name_id
+
+        key = (iid, name_id, value, kind)
+        if key in self.seen_entries:
+            self.nb_duplicates += 1
+            return
+        self.seen_entries.add(key)
+
+        info_id = self.info_to_id.get(info)
+        if info_id is None:
+            info_id = len(self.infos)
+            self.infos.append(info)
+            self.info_to_id[info] = info_id
 
-        if len(self.buffer) % 10000000 == 0:
-            self.write_to_file()
+        self.iids.append(iid)
+        self.name_ids.append(name_id)
+        self.values.append(value)
+        self.kinds.append(kind)
+        self.info_ids.append(info_id)
+
+        if len(self.iids) >= self.chunk_size:
+            self._flush()
 
     def append_name(self, iid, name, raw_value):
-        self._append(iid, name, raw_value, "name")
+        self._append(iid, name, raw_value, name_kind)
 
     def append_call(self, iid, fct, raw_args, raw_kwargs, raw_value):
         fct_name = fct.__name__ if hasattr(fct, "__name__") else str(fct)
         if " " in fct_name:  # some fcts don't have a proper name
             fct_name = fct_name.split(" ")[0]
 
-        self._append(iid, fct_name, raw_value, "call")
+        self._append(iid, fct_name, raw_value, call_kind)
 
     def append_attribute(self, iid, raw_base, attr_name, raw_value):
-        self._append(iid, attr_name, raw_value, "attribute")
-
-    def write_to_file(self):
-        file_name = f"trace_{timestamp()}.h5"
-        logger.info(f"Writing to {file_name}, and flushing buffer")
-
-        df = pd.DataFrame(data=self.buffer, columns=column_names)
-        df["iid"] = df["iid"].astype("int")
-        df["name"] = df["name"].astype("str")
-        df["value"] = df["value"].astype("str")
-        df["kind"] = df["kind"].astype("str")
-        df["info"] = df["info"].astype("str")
+        self._append(iid, attr_name, raw_value, attribute_kind)
 
-        logger.info(f"Deduplicating {len(df)} trace entries")
-        df.drop_duplicates(
-            subset=["iid", "name", "value", "kind"], inplace=True)
-        logger.info(f"After deduplicating: {len(df)} trace entries")
+    def _flush(self):
+        if len(self.iids) > 0:
+            # the dictionaries only grow, so a snapshot of their current
+            # length covers all ids in this chunk
+            chunk = (self.iids, self.name_ids, self.values, self.kinds, self.info_ids,
+                     self.names[:], self.infos[:])
+            self.chunks.put(chunk)
+            self._new_buffer()
 
-        df.to_hdf(file_name, key="entries", complevel=9, complib="bzip2")
+    def _write_chunks(self):
+        writer = None
+        nb_written = 0
+        while True:
+            chunk = self.chunks.get()
+            if chunk is None:
+                break
+            try:
+                iids, name_ids, values, kind_codes, info_ids, names, infos = chunk
+                if writer is None:
+                    # only write dictionary entries that are new since the last chunk
+                    options = pa.ipc.IpcWriteOptions(
+                        compression="zstd", emit_dictionary_deltas=True)
+                    writer = pa.ipc.new_stream(
+                        self.file_name, schema, options=options)
+                batch = pa.record_batch([
+                    _to_arrow(iids, pa.int32()),
+                    pa.DictionaryArray.from_arrays(
+                        _to_arrow(name_ids, pa.int32()), pa.array(names, type=pa.string())),
+                    pa.DictionaryArray.from_arrays(
+                        _to_arrow(values, pa.uint8()), value_dictionary),
+                    pa.DictionaryArray.from_arrays(
+                        _to_arrow(kind_codes, pa.uint8()), kind_dictionary),
+                    pa.DictionaryArray.from_arrays(
+                        _to_arrow(info_ids, pa.int32()), pa.array(infos, type=pa.string())),
+                ], schema=schema)
+                writer.write_batch(batch)
+                nb_written += len(iids)
+            except Exception as e:
+                logger.info(f"Error while writing trace chunk: {e}")
+        if writer is not None:
+            writer.close()
+            logger.info(f"Wrote {nb_written} trace entries to {self.file_name}")
 
-        self.buffer = []
+    def close(self):
+        if self.replay_writer is not None:
+            self.replay_writer.close()
+        self._flush()
+        self.chunks.put(None)
+        self.writer_thread.join()
+        logger.info(
+            f"Skipped {self.nb_duplicates} duplicate trace entries")
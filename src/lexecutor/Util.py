@@ -1,4 +1,8 @@
+import atexit
 from datetime import datetime
+import os
+import signal
+import threading
 
 
 def gather_files(files_arg, suffix=".py"):
@@ -20,3 +24,23 @@ def timestamp():
     epoch = datetime.utcfromtimestamp(0)
     now = datetime.now()
     return round((now-epoch).total_seconds()*1000000.0)
+
+
+def run_exit_handlers_on_sigterm():
+    # Experiments stop programs that time out with SIGTERM, which skips atexit
+    # handlers. Run them on SIGTERM, and then terminate with the default
+    # action of SIGTERM. Raising SystemExit instead would let the program
+    # catch it (e.g., with a bare except) and keep running.
+    # Signal handlers can only be set from the main thread.
+    if threading.current_thread() is not threading.main_thread() \
+            or signal.getsignal(signal.SIGTERM) != signal.SIG_DFL:
+        return
+
+    def handle_sigterm(signum, frame):
+        try:
+            atexit._run_exitfuncs()
+        finally:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            os.kill(os.getpid(), signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, handle_sigterm)
@@ -3,71 +3,6 @@ from .Hyperparams import Hyperparams as params
 import random
 
 
-def abstract_value(value):
-    t = type(value)
-    # common primitive values
-    if value is None:
-        abtract_value = "@None"
-    elif value is True:
-        abtract_value = "@True"
-    elif value is False:
-        abtract_value = "@False"
-    # strings
-    elif t is str:
-        if len(value) == 0:
-            abtract_value = "@str_empty"
-        else:
-            abtract_value = "@str_nonempty"
-    # built-in numeric types
-    elif t is int:
-        if value < 0:
-            abtract_value = "@int_neg"
-        elif value == 0:
-            abtract_value = "@int_zero"
-        else:
-            abtract_value = "@int_pos"
-    elif t is float:
-        if value < 0:
-            abtract_value = "@float_neg"
-        elif value == 0:
-            abtract_value = "@float_zero"
-        else:
-            abtract_value = "@float_pos"
-    # built-in sequence types
-    elif t is list:
-        if len(value) == 0:
-            abtract_value = "@list_empty"
-        else:
-            abtract_value = "@list_nonempty"
-    elif t is tuple:
-        if len(value) == 0:
-            abtract_value = "@tuple_empty"
-        else:
-            abtract_value = "@tuple_nonempty"
-    # built-in set and dict types
-    elif t is set:
-        if len(value) == 0:
-            abtract_value = "@set_empty"
-        else:
-            abtract_value = "@set_nonempty"
-    elif t is dict:
-        if len(value) == 0:
-            abtract_value = "@dict_empty"
-        else:
-            abtract_value = "@dict_nonempty"
-    # functions and methods
-    elif callable(value):
-        if hasattr(value, "__enter__") and hasattr(value, "__exit__"):
-            abtract_value = "@resource"
-        else:
-            abtract_value = "@callable"
-    # all other types
-    else:
-        abtract_value = "@object"
-
-    return abtract_value, str(t)[:20]
-
-
 class DummyResource(object):
     def __enter__(self):
         return self
@@ -106,138 +41,205 @@ fine_to_coarse_grained = {
     "@object": "@object",
 }
 
+# small integer codes of the (fine-grained) abstract values
+abstract_values = list(fine_to_coarse_grained.keys())
+abstract_value_to_code = {v: code for code, v in enumerate(abstract_values)}
 
-if params.value_abstraction.startswith("coarse-grained"):
-    if params.value_abstraction == "coarse-grained-deterministic":
-        def restore_value(abstract_value):
-            # common primitive values
-            if abstract_value == "None":
-                return None
-            elif abstract_value == "bool":
-                return True
-            # strings
-            elif abstract_value == "str":
-                return "a"
-            # built-in numeric types
-            elif abstract_value == "int":
-                return 1
-            elif abstract_value == "float":
-                return 1.0
-            # built-in sequence types
-            elif abstract_value == "list":
-                return [DummyObject()]
-            elif abstract_value == "tuple":
-                return (DummyObject(),)
-            # built-in set and dict types
-            elif abstract_value == "set":
-                return {DummyObject()}
-            elif abstract_value == "dict":
-                return {"a": DummyObject()}
-            # functions and methods
-            elif abstract_value == "resource":
-                return DummyResource()
-            elif abstract_value == "callable":
-                return DummyObject
-            elif abstract_value == "object":
-                return DummyObject()
-            # all other types
-            else:
-                logger.info("Unknown abstract value: %s", abstract_value)
-                return DummyObject()
-    elif params.value_abstraction == "coarse-grained-randomized":
-        def restore_value(abstract_value):
-            # common primitive values
-            if abstract_value == "None":
-                return None
-            elif abstract_value == "bool":
-                return random.choice([True, False])
-            # strings
-            elif abstract_value == "str":
-                return random.choice(["", "a"])
-            # built-in numeric types
-            elif abstract_value == "int":
-                return random.choice([-1, 0, 1])
-            elif abstract_value == "float":
-                return random.choice([-1.0, 0.0, 1.0])
-            # built-in sequence types
-            elif abstract_value == "list":
-                return random.choice([[], [DummyObject()]])
-            elif abstract_value == "tuple":
-                return random.choice([(), (DummyObject(),)])
-            # built-in set and dict types
-            elif abstract_value == "set":
-                return random.choice([{}, {DummyObject()}])
-            elif abstract_value == "dict":
-                return random.choice([{}, {"a": DummyObject()}])
-            # functions and methods
-            elif abstract_value == "resource":
-                return DummyResource()
-            elif abstract_value == "callable":
-                return DummyObject
-            elif abstract_value == "object":
-                return DummyObject()
-            # all other types
-            else:
-                logger.info("Unknown abstract value: %s", abstract_value)
-                return DummyObject()
 
+def _sign_classifier(neg, zero, pos):
+    neg, zero, pos = abstract_value_to_code[neg], abstract_value_to_code[zero], abstract_value_to_code[pos]
+
+    def classify(value):
+        if value < 0:
+            return neg
+        elif value == 0:
+            return zero
+        else:
+            return pos
+    return classify
+
+
+def _size_classifier(empty, nonempty):
+    empty, nonempty = abstract_value_to_code[empty], abstract_value_to_code[nonempty]
+
+    def classify(value):
+        return nonempty if len(value) else empty
+    return classify
+
+
+_none_code = abstract_value_to_code["@None"]
+_true_code = abstract_value_to_code["@True"]
+_false_code = abstract_value_to_code["@False"]
+_resource_code = abstract_value_to_code["@resource"]
+_callable_code = abstract_value_to_code["@callable"]
+_object_code = abstract_value_to_code["@object"]
+
+# classifiers of built-in types whose abstract value depends on the value
+_type_to_classifier = {
+    # common primitive values
+    type(None): lambda value: _none_code,
+    bool: lambda value: _true_code if value else _false_code,
+    # strings
+    str: _size_classifier("@str_empty", "@str_nonempty"),
+    # built-in numeric types
+    int: _sign_classifier("@int_neg", "@int_zero", "@int_pos"),
+    float: _sign_classifier("@float_neg", "@float_zero", "@float_pos"),
+    # built-in sequence types
+    list: _size_classifier("@list_empty", "@list_nonempty"),
+    tuple: _size_classifier("@tuple_empty", "@tuple_nonempty"),
+    # built-in set and dict types
+    set: _size_classifier("@set_empty", "@set_nonempty"),
+    dict: _size_classifier("@dict_empty", "@dict_nonempty"),
+}
+
+# abstract values of all other types, which depend only on the type
+_type_to_code = {}
+
+_type_to_info = {}
+
+
+def _classify_other(value):
+    # functions and methods
+    if callable(value):
+        if hasattr(value, "__enter__") and hasattr(value, "__exit__"):
+            return _resource_code
+        else:
+            return _callable_code
+    # all other types
+    else:
+        return _object_code
+
+
+def abstract_value(value):
+    # returns the code of the abstract value (an index into abstract_values)
+    # and a short description of the value's type
+    t = type(value)
+
+    info = _type_to_info.get(t)
+    if info is None:
+        info = str(t)[:20]
+        _type_to_info[t] = info
+
+    classifier = _type_to_classifier.get(t)
+    if classifier is not None:
+        return classifier(value), info
+
+    code = _type_to_code.get(t)
+    if code is None:
+        code = _classify_other(value)
+        # classes are all of type `type` (or a metaclass), but only some are resources
+        if not issubclass(t, type):
+            _type_to_code[t] = code
+    return code, info
+
+
+def _shared(value):
+    # immutable values can be shared by all restored values
+    return lambda: value
+
+
+def _random(*factories):
+    return lambda: random.choice(factories)()
+
+
+# factories that create a concrete value for each abstract value
+if params.value_abstraction == "coarse-grained-deterministic":
+    value_factories = {
+        # common primitive values
+        "None": _shared(None),
+        "bool": _shared(True),
+        # strings
+        "str": _shared("a"),
+        # built-in numeric types
+        "int": _shared(1),
+        "float": _shared(1.0),
+        # built-in sequence types
+        "list": lambda: [DummyObject()],
+        "tuple": lambda: (DummyObject(),),
+        # built-in set and dict types
+        "set": lambda: {DummyObject()},
+        "dict": lambda: {"a": DummyObject()},
+        # functions and methods
+        "resource": DummyResource,
+        "callable": _shared(DummyObject),
+        "object": DummyObject,
+    }
+elif params.value_abstraction == "coarse-grained-randomized":
+    value_factories = {
+        # common primitive values
+        "None": _shared(None),
+        "bool": _random(_shared(True), _shared(False)),
+        # strings
+        "str": _random(_shared(""), _shared("a")),
+        # built-in numeric types
+        "int": _random(_shared(-1), _shared(0), _shared(1)),
+        "float": _random(_shared(-1.0), _shared(0.0), _shared(1.0)),
+        # built-in sequence types
+        "list": _random(list, lambda: [DummyObject()]),
+        "tuple": _random(_shared(()), lambda: (DummyObject(),)),
+        # built-in set and dict types
+        "set": _random(set, lambda: {DummyObject()}),
+        "dict": _random(dict, lambda: {"a": DummyObject()}),
+        # functions and methods
+        "resource": DummyResource,
+        "callable": _shared(DummyObject),
+        "object": DummyObject,
+    }
 elif params.value_abstraction == "fine-grained":
-    def restore_value(abstract_value):
+    value_factories = {
         # common primitive values
-        if abstract_value == "None":
-            return None
-        elif abstract_value == "True":
-            return True
-        elif abstract_value == "False":
-            return False
+        "None": _shared(None),
+        "True": _shared(True),
+        "False": _shared(False),
         # strings
-        elif abstract_value == "str_empty":
-            return ""
-        elif abstract_value == "str_nonempty":
-            return "a"
+        "str_empty": _shared(""),
+        "str_nonempty": _shared("a"),
         # built-in numeric types
-        elif abstract_value == "int_neg":
-            return -1
-        elif abstract_value == "int_zero":
-            return 0
-        elif abstract_value == "int_pos":
-            return 1
-        elif abstract_value == "float_neg":
-            return -1.0
-        elif abstract_value == "float_zero":
-            return 0.0
-        elif abstract_value == "float_pos":
-            return 1.0
+        "int_neg": _shared(-1),
+        "int_zero": _shared(0),
+        "int_pos": _shared(1),
+        "float_neg": _shared(-1.0),
+        "float_zero": _shared(0.0),
+        "float_pos": _shared(1.0),
         # built-in sequence types
-        elif abstract_value == "list_empty":
-            return []
-        elif abstract_value == "list_nonempty":
-            return [DummyObject()]
-        elif abstract_value == "tuple_empty":
-            return ()
-        elif abstract_value == "tuple_nonempty":
-            return (DummyObject(),)
+        "list_empty": list,
+        "list_nonempty": lambda: [DummyObject()],
+        "tuple_empty": _shared(()),
+        "tuple_nonempty": lambda: (DummyObject(),),
         # built-in set and dict types
-        elif abstract_value == "set_empty":
-            return set()
-        elif abstract_value == "set_nonempty":
-            return {DummyObject()}
-        elif abstract_value == "dict_empty":
-            return {}
-        elif abstract_value == "dict_nonempty":
-            return {"a": DummyObject()}
+        "set_empty": set,
+        "set_nonempty": lambda: {DummyObject()},
+        "dict_empty": dict,
+        "dict_nonempty": lambda: {"a": DummyObject()},
         # functions and methods
-        elif abstract_value == "resource":
-            return DummyResource()
-        elif abstract_value == "callable":
-            return DummyObject
-        elif abstract_value == "object":
-            return DummyObject()
-        # all other types
-        else:
-            logger.info("Unknown abstract value: %s", abstract_value)
-            return DummyObject()
-
+        "resource": DummyResource,
+        "callable": _shared(DummyObject),
+        "object": DummyObject,
+    }
 else:
     raise ValueError(
         f"Unknown setting for value_abstraction: {params.value_abstraction}")
+
+
+def value_factory(abstract_value):
+    factory = value_factories.get(abstract_value)
+    if factory is None:
+        # all other types
+        logger.info("Unknown abstract value: %s", abstract_value)
+        return DummyObject
+    return factory
+
+
+# factories indexed by the codes of fine-grained abstract values (see abstract_value)
+if params.value_abstraction.startswith("coarse-grained"):
+    code_to_value_factory = [value_factory(
+        fine_to_coarse_grained[v][1:]) for v in abstract_values]
+else:
+    code_to_value_factory = [value_factory(v[1:]) for v in abstract_values]
+
+
+def restore_value(abstract_value):
+    factory = value_factories.get(abstract_value)
+    if factory is None:
+        return value_factory(abstract_value)()
+    return factory()
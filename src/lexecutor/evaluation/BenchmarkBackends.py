@@ -0,0 +1,84 @@
+import argparse
+import copy
+import time
+import torch as t
+from ..Hyperparams import Hyperparams as params
+from ..predictors.DLUtil import device
+from ..predictors.codet5.CodeT5 import load_CodeT5
+from ..predictors.codet5.ModelServer import get_model_path
+from ..predictors.codet5.CandidateScorer import CandidateScorer
+from ..predictors.codet5.InferenceBackend import backends, load_backend
+from ..predictors.ShardedTensors import length_bucketed_loader
+
+# Compares the latency and the top-1 accuracy of the backends that the model
+# server can run CodeT5 with, on the same validation batches.
+#   python -m lexecutor.evaluation.BenchmarkBackends --tensors validate.pt
+
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "--tensors", help=".pt file or .manifest.json file of sharded validation tensors", default="validate.pt")
+parser.add_argument(
+    "--model", help="Fine-tuned model (default: the released model for the current value abstraction)")
+parser.add_argument(
+    "--backends", help="Backends to compare", nargs="+", choices=backends, default=backends)
+parser.add_argument(
+    "--batches", help="Number of batches to measure", type=int, default=20)
+parser.add_argument(
+    "--batch_size", help="Number of examples per batch", type=int, default=params.batch_size_CodeT5)
+
+
+def measure(scorer, batches, tokenizer):
+    predictions = []
+    nb_correct = 0
+    latencies = []
+    with t.no_grad():
+        for input_ids, attention_mask, label_ids in batches:
+            labels = tokenizer.batch_decode(
+                label_ids, skip_special_tokens=True)
+            start_time = time.time()
+            top_predictions = scorer.top_k(input_ids.to(scorer.backend.device),
+                                           attention_mask.to(scorer.backend.device), 1)
+            latencies.append(time.time() - start_time)
+
+            batch_predictions = [top[0][0] for top in top_predictions]
+            nb_correct += sum(label == prediction for label,
+                              prediction in zip(labels, batch_predictions))
+            predictions.extend(batch_predictions)
+    return predictions, nb_correct, latencies
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    tokenizer, model = load_CodeT5()
+    model_path = args.model if args.model is not None else get_model_path()
+    model.load_state_dict(t.load(model_path, map_location=device))
+    model.eval()
+
+    batches = []
+    for batch in length_bucketed_loader(args.tensors, args.batch_size, tokenizer.pad_token_id):
+        batches.append(batch)
+        if len(batches) == args.batches:
+            break
+    nb_examples = sum(len(input_ids) for input_ids, _, _ in batches)
+
+    reference_predictions = None
+    for backend_name in args.backends:
+        # the quantizing and exporting backends modify (or move) the model
+        backend = load_backend(backend_name, copy.deepcopy(model), model_path)
+        scorer = CandidateScorer(backend, tokenizer)
+        # warm up before measuring
+        measure(scorer, batches[:1], tokenizer)
+
+        predictions, nb_correct, latencies = measure(
+            scorer, batches, tokenizer)
+        if reference_predictions is None:
+            reference_predictions = predictions
+        agreement = sum(p == r for p, r in zip(
+            predictions, reference_predictions)) / nb_examples
+
+        print(f"{backend_name:>12} on {backend.device}: "
+              f"{1000 * sum(latencies) / len(latencies):.1f} ms/batch, "
+              f"{1000 * sum(latencies) / nb_examples:.2f} ms/example, "
+              f"top-1 accuracy {nb_correct / nb_examples:.4f}, "
+              f"agreement with {args.backends[0]} {agreement:.4f}")
@@ -0,0 +1,73 @@
+import argparse
+import random
+import time
+import requests
+from ..Hyperparams import Hyperparams as params
+from ..IIDs import IIDs
+from ..Util import gather_files
+from ..predictors.Prefetch import gather_entries
+from ..predictors.codet5.Transport import connect, send_frame, recv_frame
+
+# Compares the throughput of the model server's socket transport with the
+# legacy HTTP endpoint. Start the server with both transports first:
+#   python -m lexecutor.predictors.codet5.ModelServer --http
+
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "--files", help="Instrumented Python files or .txt file with all file paths, to draw queries from", nargs="+", required=True)
+parser.add_argument(
+    "--queries", help="Number of queries per measurement", type=int, default=500)
+parser.add_argument(
+    "--batch_size", help="Number of queries per frame for the batched socket measurement", type=int, default=50)
+
+
+def http_queries(entries):
+    # one new connection per query, as done by the HTTP client
+    for entry in entries:
+        raw_response = requests.get(
+            "http://localhost:5000/query", params=entry)
+        if raw_response.status_code != 200:
+            raise RuntimeError(
+                f"Model server returned error code {raw_response.status_code}")
+
+
+def socket_queries(entries, batch_size):
+    connection = connect(params.model_server_socket)
+    for batch_start in range(0, len(entries), batch_size):
+        batch = entries[batch_start:batch_start+batch_size]
+        send_frame(connection, [[e["iid"], e["name"], e["kind"]]
+                   for e in batch])
+        if recv_frame(connection) is None:
+            raise RuntimeError("Model server closed the connection")
+    connection.close()
+
+
+def measure(query_fct, entries):
+    start_time = time.time()
+    query_fct(entries)
+    return len(entries) / (time.time() - start_time)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    iids = IIDs(params.iids_file)
+    all_entries = []
+    for file in gather_files(args.files):
+        all_entries.extend(gather_entries(file, iids))
+    if len(all_entries) == 0:
+        raise Exception("No instrumented entries found in the given files")
+    entries = random.choices(all_entries, k=args.queries)
+
+    # warm up the model before measuring
+    socket_queries(entries[:10], 1)
+
+    http_qps = measure(http_queries, entries)
+    socket_qps = measure(lambda e: socket_queries(e, 1), entries)
+    batched_qps = measure(lambda e: socket_queries(
+        e, args.batch_size), entries)
+
+    print(f"HTTP /query:                       {http_qps:.1f} queries/sec")
+    print(f"Socket, one query per frame:       {socket_qps:.1f} queries/sec")
+    print(
+        f"Socket, {args.batch_size} queries per frame:      {batched_qps:.1f} queries/sec")
@@ -0,0 +1,70 @@
+import argparse
+import time
+import torch as t
+from ..Hyperparams import Hyperparams as params
+from ..predictors.codet5.CodeT5 import load_CodeT5
+from ..predictors.ShardedTensors import length_bucketed_loader
+
+# Compares the CPU throughput of CodeT5 on inputs padded to 512 tokens
+# without attention masks (as done before variable-length inputs) with
+# length-bucketed batches that are padded only up to their longest input.
+#   python -m lexecutor.evaluation.BenchmarkPadding --tensors validate.pt
+
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "--tensors", help=".pt file or .manifest.json file of sharded tensors", required=True)
+parser.add_argument(
+    "--batches", help="Number of batches per measurement", type=int, default=10)
+parser.add_argument(
+    "--batch_size", help="Number of examples per batch", type=int, default=params.batch_size_CodeT5)
+
+
+def padded_to_512(batches, pad_token_id):
+    for input_ids, _, label_ids in batches:
+        padding = t.full((input_ids.shape[0], 512 - input_ids.shape[1]),
+                         pad_token_id, dtype=input_ids.dtype)
+        yield t.cat([input_ids, padding], dim=1), None, label_ids
+
+
+def measure(model, batches, generate):
+    nb_examples = 0
+    start_time = time.time()
+    with t.no_grad():
+        for input_ids, attention_mask, label_ids in batches:
+            if generate:
+                model.generate(input_ids, attention_mask=attention_mask,
+                               max_length=params.max_output_length)
+            else:
+                # the same label ids as in FineTune
+                model(input_ids, attention_mask=attention_mask,
+                      labels=label_ids[:, 0:params.nb_trained_label_ids])
+            nb_examples += input_ids.shape[0]
+    return nb_examples / (time.time() - start_time)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    tokenizer, model = load_CodeT5()
+    model.to("cpu")
+    model.eval()
+
+    # the same randomly drawn examples for both measurements
+    loader = length_bucketed_loader(
+        args.tensors, args.batch_size, tokenizer.pad_token_id, shuffle=True)
+    batches = []
+    for batch in loader:
+        batches.append(batch)
+        if len(batches) == args.batches:
+            break
+    lengths = t.cat([attention_mask.sum(dim=1)
+                    for _, attention_mask, _ in batches]).float()
+    print(f"Input lengths: mean {lengths.mean():.1f}, max {lengths.max():.0f} tokens")
+
+    for generate in [False, True]:
+        padded_eps = measure(model, padded_to_512(
+            batches, tokenizer.pad_token_id), generate)
+        bucketed_eps = measure(model, batches, generate)
+        mode = "generate" if generate else "forward with labels"
+        print(f"{mode}, padded to 512:      {padded_eps:.1f} examples/sec")
+        print(f"{mode}, length-bucketed:    {bucketed_eps:.1f} examples/sec")
@@ -0,0 +1,192 @@
+import argparse
+import sys
+import timeit
+import types
+
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "--events", help="Number of events per hook and measurement", type=int, default=1000000)
+parser.add_argument(
+    "--repeat", help="Number of measurements per hook (the fastest one is reported)", type=int, default=5)
+
+
+class StubStats:
+    # isolates the hook overhead from the cost of tracking runtime stats
+    def __init__(self, execution=None, file=None):
+        self.total_uses = 0
+        self.guided_uses = 0
+
+    def cover_iid(self, iid):
+        pass
+
+    def uncaught_exception(self, iid, e):
+        pass
+
+    def print(self):
+        pass
+
+    def save(self, file, predictor_name, start_time):
+        pass
+
+
+class StubPredictor:
+    # the benchmarked events never need a prediction
+    def __init__(self, *args):
+        pass
+
+
+# Runtime creates its predictor and runtime stats when imported in PREDICT
+# mode. Replace their modules by stubs before importing it, so that the
+# benchmark neither starts a model server nor loads caches or iids, nor
+# writes metrics, and only measures the hooks.
+sys.modules["lexecutor.RuntimeStats"] = types.SimpleNamespace(
+    RuntimeStats=StubStats, executed_file_and_execution=lambda: (sys.argv[0], ""))
+for module_name, class_name in [
+        ("lexecutor.predictors.AsIs", "AsIs"),
+        ("lexecutor.predictors.NaiveValuePredictor", "NaiveValuePredictor"),
+        ("lexecutor.predictors.RandomPredictor", "RandomPredictor"),
+        ("lexecutor.predictors.FrequencyValuePredictor", "FrequencyValuePredictor"),
+        ("lexecutor.predictors.codet5.CodeT5ValuePredictor", "CodeT5ValuePredictor"),
+        ("lexecutor.predictors.codebert.CodeBERTValuePredictor", "CodeBERTValuePredictor"),
+        ("lexecutor.predictors.Type4PyValuePredictor", "Type4PyValuePredictor")]:
+    sys.modules[module_name] = types.SimpleNamespace(**{class_name: StubPredictor})
+
+from .. import Runtime  # noqa: E402
+from ..ValueAbstraction import DummyObject  # noqa: E402
+from ..Hyperparams import Hyperparams as params  # noqa: E402
+from ..Logging import logger  # noqa: E402
+
+
+# the closure-based hooks as implemented before the mode-specialized fast path,
+# kept here as the baseline to compare against
+def legacy_n_(iid, name, lambada):
+    if params.verbose:
+        logger.info(f"\nAt iid={iid}, looking up name '{name}'")
+
+    perform_fct = lambada
+
+    def record_fct(v):
+        Runtime.trace.append_name(iid, name, v)
+
+    def predict_fct():
+        return Runtime._predict_name(iid, name)
+
+    if Runtime.runtime_stats is not None:
+        Runtime.runtime_stats.total_uses += 1
+        Runtime.runtime_stats.cover_iid(iid)
+    return legacy_mode_branch(iid, perform_fct, record_fct, predict_fct, kind="name")
+
+
+def legacy_c_(iid, fct, *args, **kwargs):
+    if params.verbose:
+        logger.info(f"\nAt iid={iid}, calling function {fct}")
+
+    def perform_fct():
+        return fct(*args, **kwargs)
+
+    def record_fct(v):
+        Runtime.trace.append_call(iid, fct, args, kwargs, v)
+
+    def predict_fct():
+        return Runtime._predict_call(iid, fct, args, kwargs)
+
+    if Runtime.runtime_stats is not None:
+        Runtime.runtime_stats.total_uses += 1
+        Runtime.runtime_stats.cover_iid(iid)
+    kind = "call_dummy" if fct is DummyObject else "call"
+    return legacy_mode_branch(iid, perform_fct, record_fct, predict_fct, kind=kind)
+
+
+def legacy_a_(iid, base, attr_name):
+    if params.verbose:
+        logger.info(f"\nAt iid={iid}, looking up attribute '{attr_name}'")
+
+    def perform_fct():
+        return Runtime._get_attribute(base, attr_name)
+
+    def record_fct(v):
+        Runtime.trace.append_attribute(iid, base, attr_name, v)
+
+    def predict_fct():
+        return Runtime._predict_attribute(iid, base, attr_name)
+
+    if Runtime.runtime_stats is not None:
+        Runtime.runtime_stats.total_uses += 1
+        Runtime.runtime_stats.cover_iid(iid)
+    return legacy_mode_branch(iid, perform_fct, record_fct, predict_fct, kind="attribute")
+
+
+def legacy_mode_branch(iid, perform_fct, record_fct, predict_fct, kind):
+    if Runtime.mode == "RECORD":
+        v = perform_fct()
+        record_fct(v)
+        return v
+    elif Runtime.mode == "PREDICT":
+        if kind == "call_dummy":
+            return predict_fct()
+        else:
+            try:
+                v = perform_fct()
+                if params.verbose:
+                    logger.info("Found/computed/returned regular value")
+                return v
+            except Exception as e:
+                if (type(e) == NameError and kind == "name") \
+                        or (type(e) == AttributeError and kind == "attribute"):
+                    if params.verbose:
+                        logger.info(
+                            f"Catching '{type(e)}' during {kind} and calling predictor instead")
+                    v = predict_fct()
+                    Runtime.runtime_stats.guided_uses += 1
+                    return v
+                else:
+                    if params.verbose:
+                        logger.info(
+                            f"Exception '{type(e)}' not caught, re-raising")
+                    Runtime.runtime_stats.uncaught_exception(iid, e)
+                    raise e
+    else:
+        raise Exception(f"Unsupported mode {Runtime.mode}")
+
+
+class Base:
+    attr = 23
+
+
+def events(n_hook, c_hook, a_hook, nb_events):
+    base = Base()
+    x = 5
+    for _ in range(nb_events):
+        n_hook(1, "x", lambda: x)
+        c_hook(2, len, "abc")
+        a_hook(3, base, "attr")
+
+
+def reset():
+    if Runtime.mode == "RECORD":
+        Runtime.trace._new_buffer()  # don't write the benchmark events to a trace file
+
+
+def measure(n_hook, c_hook, a_hook, nb_events, repeat):
+    timer = timeit.Timer(lambda: events(n_hook, c_hook, a_hook, nb_events), setup=reset)
+    best = min(timer.repeat(repeat=repeat, number=1))
+    # three hook invocations per iteration
+    return best / (3 * nb_events) * 1e9
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    if Runtime.mode not in ("RECORD", "PREDICT"):
+        raise Exception(f"Benchmark supports RECORD and PREDICT mode, not {Runtime.mode}")
+
+    legacy_ns = measure(legacy_n_, legacy_c_, legacy_a_,
+                        args.events, args.repeat)
+    fast_ns = measure(Runtime._n_, Runtime._c_, Runtime._a_,
+                      args.events, args.repeat)
+    reset()
+
+    print(f"Mode: {Runtime.mode}")
+    print(f"Closure-based hooks:      {legacy_ns:.1f} ns/event")
+    print(f"Mode-specialized hooks:   {fast_ns:.1f} ns/event")
+    print(f"Speedup: {legacy_ns / fast_ns:.2f}x")
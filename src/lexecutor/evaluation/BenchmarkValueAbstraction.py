@@ -0,0 +1,93 @@
+import argparse
+import random
+import timeit
+from ..ValueAbstraction import abstract_value, abstract_value_to_code, DummyResource
+
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "--values", help="Number of values to abstract per measurement", type=int, default=1000000)
+parser.add_argument(
+    "--repeat", help="Number of measurements (the fastest one is reported)", type=int, default=5)
+
+
+# the if/elif chain as implemented before the type-dispatch table,
+# kept here as the baseline to compare against
+def legacy_abstract_value(value):
+    t = type(value)
+    if value is None:
+        abtract_value = "@None"
+    elif value is True:
+        abtract_value = "@True"
+    elif value is False:
+        abtract_value = "@False"
+    elif t is str:
+        abtract_value = "@str_empty" if len(value) == 0 else "@str_nonempty"
+    elif t is int:
+        abtract_value = "@int_neg" if value < 0 else (
+            "@int_zero" if value == 0 else "@int_pos")
+    elif t is float:
+        abtract_value = "@float_neg" if value < 0 else (
+            "@float_zero" if value == 0 else "@float_pos")
+    elif t is list:
+        abtract_value = "@list_empty" if len(value) == 0 else "@list_nonempty"
+    elif t is tuple:
+        abtract_value = "@tuple_empty" if len(value) == 0 else "@tuple_nonempty"
+    elif t is set:
+        abtract_value = "@set_empty" if len(value) == 0 else "@set_nonempty"
+    elif t is dict:
+        abtract_value = "@dict_empty" if len(value) == 0 else "@dict_nonempty"
+    elif callable(value):
+        if hasattr(value, "__enter__") and hasattr(value, "__exit__"):
+            abtract_value = "@resource"
+        else:
+            abtract_value = "@callable"
+    else:
+        abtract_value = "@object"
+
+    return abstract_value_to_code[abtract_value], str(t)[:20]
+
+
+class UserClass:
+    def method(self):
+        pass
+
+
+# (value, weight) pairs, roughly following the distribution of values
+# observed when recording traces of test suites
+weighted_values = [
+    (None, 12), (True, 4), (False, 4),
+    ("", 2), ("abc", 12),
+    (-1, 1), (0, 4), (42, 10), (0.0, 1), (3.14, 2),
+    ([], 2), ([1, 2], 5), ((), 1), ((1,), 4),
+    (set(), 1), ({1}, 1), ({}, 2), ({"a": 1}, 5),
+    (len, 6), (UserClass().method, 6), (UserClass, 3), (lambda: 0, 2),
+    (DummyResource(), 1), (open, 1),
+    (UserClass(), 10), (object(), 2),
+]
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    values = [v for v, _ in weighted_values]
+    weights = [w for _, w in weighted_values]
+    sample = random.choices(values, weights, k=args.values)
+
+    for value in values:
+        assert abstract_value(value) == legacy_abstract_value(
+            value), f"Different abstraction of {value}"
+
+    def run(abstract_fct):
+        for value in sample:
+            abstract_fct(value)
+
+    legacy_time = min(timeit.Timer(lambda: run(legacy_abstract_value)).repeat(
+        repeat=args.repeat, number=1))
+    dispatch_time = min(timeit.Timer(lambda: run(abstract_value)).repeat(
+        repeat=args.repeat, number=1))
+
+    print(
+        f"If/elif chain:        {legacy_time / args.values * 1e9:.1f} ns/value")
+    print(
+        f"Type-dispatch table:  {dispatch_time / args.values * 1e9:.1f} ns/value")
+    print(f"Speedup: {legacy_time / dispatch_time:.2f}x")
@@ -1,5 +1,6 @@
 import os
 import pandas as pd
+from ..Coverage import merge_coverage_files
 
 folder_path = "./metrics/"
 
@@ -14,36 +15,44 @@ for dataset in datasets:
     
     for predictor in predictors:
         # Get a list of raw metric files
-        files = os.listdir(f'{folder_path}{dataset}/{predictor}/raw') 
-        
-        all_executions_df = pd.DataFrame()
-
-        for execution in range(1, 11):
-
-            # Filter the files to include only the ones that match the pattern "metrics_x.csv"
-            matching_files = [file for file in files if file.startswith("metrics_") and file.endswith(f"_{execution}.csv")]
-
-            combined_df_for_predictor = pd.DataFrame()
-
-            for file in matching_files:
-                try:
-                    df = pd.read_csv(f'{folder_path}{dataset}/{predictor}/raw/{file}')
-                    combined_df_for_predictor = pd.concat([combined_df_for_predictor, df], ignore_index=True)
-                except pd.errors.EmptyDataError:
-                    print(file)
-
-            files = combined_df_for_predictor.file.unique()
-
-            for file in files:
-                indexes = combined_df_for_predictor.index[combined_df_for_predictor['file'] == file].tolist()
-                for index in indexes[:-1]:
-                    combined_df_for_predictor = combined_df_for_predictor.drop(index=index)
-
-            all_executions_df = pd.concat([all_executions_df, combined_df_for_predictor], ignore_index=True)
-
-        combined_df_for_predictor = all_executions_df.groupby('file', as_index=False)["covered_iids","total_uses","guided_uses","covered_lines","executed_lines", "execution_time", "random_predictions","type4py_predictions"].mean()
+        raw_dir = f'{folder_path}{dataset}/{predictor}/raw'
+        files = os.listdir(raw_dir)
+
+        # raw metrics files of executions 1 to 10 (.csv files are written by
+        # earlier versions of RuntimeStats), read into one frame
+        raw_files = [file for file in files if file.startswith("metrics_") and any(
+            file.endswith(f"_{execution}.jsonl") or file.endswith(f"_{execution}.csv") for execution in range(1, 11))]
+        raw_dfs = [(pd.read_json(f'{raw_dir}/{file}', lines=True) if file.endswith(".jsonl")
+                    else pd.read_csv(f'{raw_dir}/{file}')).assign(raw_file=file)
+                   for file in raw_files if os.path.getsize(f'{raw_dir}/{file}') > 0]
+        if len(raw_dfs) == 0:
+            print(f"No raw metrics found in {raw_dir} -- skipping {predictor}")
+            continue
+
+        # Only the last record of each execution of a file (i.e., the final save of the run) counts
+        all_executions_df = pd.concat(raw_dfs, ignore_index=True)
+        all_executions_df["execution"] = all_executions_df["execution"].astype(str)
+        all_executions_df = all_executions_df.groupby(
+            ["file", "execution"], as_index=False, sort=False).last()
+
+        # file -> coverage files of its executions (written by RuntimeStats since the .jsonl format)
+        coverage_files = raw_dir + "/coverage_" + \
+            all_executions_df["raw_file"].str.slice(len("metrics_")).str.replace(r"\.(jsonl|csv)$", ".npz", regex=True)
+        has_coverage = coverage_files.map(os.path.exists)
+        file_to_coverage_files = coverage_files[has_coverage].groupby(
+            all_executions_df["file"][has_coverage]).agg(list).to_dict()
+
+        combined_df_for_predictor = all_executions_df.groupby('file', as_index=False)[["covered_iids","total_uses","guided_uses","covered_lines","executed_lines", "execution_time", "random_predictions","type4py_predictions"]].mean()
         combined_df_for_predictor['predictor'] = [predictor] * len(combined_df_for_predictor)
 
+        # iids and lines covered in any of the executions of a file
+        file_to_coverage = {file: merge_coverage_files(coverage_files)
+                            for file, coverage_files in file_to_coverage_files.items()}
+        combined_df_for_predictor['covered_iids_any_execution'] = combined_df_for_predictor['file'].map(
+            lambda file: file_to_coverage[file].covered_iids() if file in file_to_coverage else None)
+        combined_df_for_predictor['covered_lines_any_execution'] = combined_df_for_predictor['file'].map(
+            lambda file: file_to_coverage[file].covered_lines() if file in file_to_coverage else None)
+
         if predictor == 'PynguinTests':
             aux_df = pd.read_csv("wrapp_info.csv")
 
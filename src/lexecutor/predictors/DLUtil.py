@@ -3,3 +3,16 @@ import torch as t
 
 dtype = t.float
 device = "cuda" if t.cuda.is_available() else "cpu"
+
+
+def pad_and_mask(all_input_ids, pad_token_id):
+    # pads sequences of token ids to the longest one and returns the padded
+    # ids with the matching attention mask (1 for real tokens, 0 for padding)
+    max_length = max(len(input_ids) for input_ids in all_input_ids)
+    padded = t.full((len(all_input_ids), max_length),
+                    pad_token_id, dtype=t.long)
+    attention_mask = t.zeros((len(all_input_ids), max_length), dtype=t.long)
+    for idx, input_ids in enumerate(all_input_ids):
+        padded[idx, :len(input_ids)] = t.as_tensor(input_ids)
+        attention_mask[idx, :len(input_ids)] = 1
+    return padded, attention_mask
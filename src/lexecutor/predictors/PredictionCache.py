@@ -0,0 +1,95 @@
+import hashlib
+import mmap
+import os
+from os import path
+import tempfile
+from ..Hyperparams import Hyperparams as params
+from ..IIDs import magic as iids_magic, header as iids_header
+from ..Logging import logger
+
+
+def _hash_iids_file(file_path, hasher):
+    # identify the iids file by path, size, modification time, and, for
+    # binary iid files, the iid range in the header, without reading it all
+    if not path.exists(file_path) or path.getsize(file_path) == 0:
+        hasher.update(b"<missing>")
+        return
+    stat = os.stat(file_path)
+    hasher.update(
+        f"{path.abspath(file_path)}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    with open(file_path, "rb") as file:
+        header = file.read(len(iids_magic) + iids_header.size)
+    if header[:len(iids_magic)] == iids_magic:
+        hasher.update(header)
+
+
+# On-disk cache of predicted abstract values, shared across executions.
+# Entries are keyed by (iid, kind, name); the iids file, the value abstraction,
+# and the model file select the cache file, so that a cache never answers
+# for another instrumentation or another model.
+class PredictionCache:
+    def __init__(self, iids_file, model_file, cache_dir=params.prediction_cache_dir):
+        hasher = hashlib.sha1()
+        _hash_iids_file(iids_file, hasher)
+        hasher.update(params.value_abstraction.encode())
+        # models are large, so identify them by path, size, and modification time
+        hasher.update(path.abspath(model_file).encode())
+        if path.exists(model_file):
+            stat = os.stat(model_file)
+            hasher.update(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+        self.file_path = path.join(
+            cache_dir, f"predictions_{hasher.hexdigest()[:16]}.txt")
+
+        self._key_to_value = self._read(self.file_path)
+        self._new_keys = set()
+        logger.info(
+            f"Loaded {len(self._key_to_value)} cached predictions from {self.file_path}")
+
+    @staticmethod
+    def _read(file_path):
+        # format: one "iid<TAB>kind<TAB>name<TAB>abstract value" entry per line
+        key_to_value = {}
+        if not path.exists(file_path) or path.getsize(file_path) == 0:
+            return key_to_value
+        # parse the memory-mapped file line by line, without copying all of it
+        with open(file_path, "rb") as file:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for line in iter(mm.readline, b""):
+                    segments = line.rstrip(b"\n").decode("utf-8").split("\t")
+                    if len(segments) != 4:
+                        continue  # partially written or corrupted line
+                    iid, kind, name, value = segments
+                    key_to_value[(int(iid), kind, name)] = value
+        return key_to_value
+
+    def get(self, iid, kind, name):
+        return self._key_to_value.get((int(iid), kind, name))
+
+    def put(self, iid, kind, name, value):
+        if "\t" in name or "\n" in name or "\t" in value or "\n" in value:
+            return  # can't be represented in the cache file
+        key = (int(iid), kind, name)
+        self._key_to_value[key] = value
+        self._new_keys.add(key)
+
+    def store(self):
+        if not self._new_keys:
+            return
+
+        # merge with entries that other processes may have written in the meantime
+        key_to_value = self._read(self.file_path)
+        for key in self._new_keys:
+            key_to_value[key] = self._key_to_value[key]
+
+        # write to a temporary file and rename it, so that readers never see a partial file
+        cache_dir = path.dirname(self.file_path)
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as file:
+            for (iid, kind, name), value in key_to_value.items():
+                file.write(f"{iid}\t{kind}\t{name}\t{value}\n")
+        os.replace(tmp_path, self.file_path)
+
+        logger.info(
+            f"Stored {len(self._new_keys)} new predictions in {self.file_path}")
+        self._new_keys = set()
@@ -0,0 +1,47 @@
+from os import path
+import re
+from ..Logging import logger
+from ..ValueAbstraction import DummyObject
+
+
+# matches the hooks inserted by CodeRewriter, e.g., _n_(23, "x", lambda: x)
+hook_call_regexp = re.compile(r"\b_([nac])_\((\d+),")
+hook_to_kind = {"n": "name", "c": "call", "a": "attribute"}
+
+
+def gather_entries(file, iids):
+    # Collect the entries (iid, name, kind) of all instrumented names, calls,
+    # and attributes in the given instrumented file, so that values can be
+    # predicted before the file executes.
+    with open(file, "r") as fp:
+        instrumented_src = fp.read()
+    iid_to_kind = {int(iid): hook_to_kind[hook]
+                   for hook, iid in hook_call_regexp.findall(instrumented_src)}
+
+    orig_file = file + ".orig"
+    if not path.exists(orig_file):
+        logger.info(f"No original file at {orig_file}, cannot gather entries")
+        return []
+    with open(orig_file, "r") as fp:
+        orig_lines = fp.readlines()
+
+    entries = []
+    for iid, kind in iid_to_kind.items():
+        try:
+            location = iids.location(iid)
+        except KeyError:
+            continue
+        if location.line > len(orig_lines):
+            continue
+        if kind == "call":
+            # the runtime predicts return values only for calls of a
+            # DummyObject, and queries them under the name of that class
+            entries.append(
+                {"iid": iid, "name": DummyObject.__name__, "kind": kind})
+            continue
+        name = orig_lines[location.line -
+                         1][location.column_start:location.column_end]
+        if not name.isidentifier():
+            continue
+        entries.append({"iid": iid, "name": name, "kind": kind})
+    return entries
@@ -0,0 +1,353 @@
+import json
+import os
+from os import path
+from functools import partial
+from multiprocessing import Pool
+import random
+import numpy as np
+import torch as t
+from torch.utils.data import DataLoader, Dataset, IterableDataset, Sampler, TensorDataset, get_worker_info
+from ..IIDs import IIDs
+from .DLUtil import pad_and_mask
+from ..Logging import logger
+from ..Hyperparams import Hyperparams as params
+
+
+# Vectorized entries can be stored as shards: .npy files of int32 token ids,
+# one row per entry, plus a JSON manifest that lists the completed shards.
+# Shards are written as soon as they are complete, so that an interrupted
+# job can resume after the last completed shard. Shards of variable-length
+# rows store all rows as one flat array, plus an .offsets.npy file with the
+# start of each row.
+shard_dtype = np.int32
+
+
+def manifest_file(output_dir, split, output_suffix):
+    return f"{output_dir}/{split}{output_suffix if output_suffix is not None else ''}.manifest.json"
+
+
+def entries_file(output_dir, split, output_suffix):
+    # the entries of a split, stored before vectorizing them, so that a resumed
+    # job vectorizes exactly the same entries
+    return f"{output_dir}/{split}{output_suffix if output_suffix is not None else ''}.entries.parquet"
+
+
+def offsets_file(shard_path):
+    return shard_path[:-len(".npy")] + ".offsets.npy"
+
+
+def load_manifest(manifest_path):
+    with open(manifest_path, "r") as file:
+        return json.load(file)
+
+
+def store_manifest(manifest, manifest_path):
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(manifest, file, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+
+def store_entries(entries, entries_path):
+    tmp_path = entries_path + ".tmp"
+    entries.to_parquet(tmp_path)
+    os.replace(tmp_path, entries_path)
+
+
+_worker_factory = None
+
+
+def _init_worker(load_tokenizer_fct, iids_file, input_factory_class):
+    # each worker has its own tokenizer and input factory
+    global _worker_factory
+    _worker_factory = input_factory_class(
+        IIDs(iids_file), load_tokenizer_fct())
+
+
+def _vectorize_shard(job):
+    shard_idx, entries, row_width, shard_path, variable_length = job
+    if variable_length:
+        vectorized, offsets = _worker_factory.entries_to_unpadded_inputs(
+            entries.reset_index(drop=True))
+        tmp_path = shard_path + ".tmp.npy"
+        np.save(tmp_path, offsets)
+        os.replace(tmp_path, offsets_file(shard_path))
+    else:
+        vectorized = np.empty([len(entries), row_width], dtype=shard_dtype)
+        _worker_factory.entries_to_inputs(
+            entries.reset_index(drop=True), vectorized)
+
+    tmp_path = shard_path + ".tmp.npy"
+    np.save(tmp_path, vectorized)
+    os.replace(tmp_path, shard_path)
+    return shard_idx, len(entries)
+
+
+def prepare_shards(entries, manifest_path, shard_size, row_width, jobs,
+                   load_tokenizer_fct, iids_file, input_factory_class, variable_length=False):
+    # with variable_length, rows are stored without padding and row_width is
+    # their maximum width
+    nb_shards = (len(entries) + shard_size - 1) // shard_size
+    shard_dir = manifest_path[:-len(".manifest.json")] + "_shards"
+    os.makedirs(shard_dir, exist_ok=True)
+
+    manifest = {"nb_entries": len(entries), "shard_size": shard_size,
+                "row_width": row_width, "dtype": np.dtype(shard_dtype).name,
+                "variable_length": variable_length, "shards": [], "complete": False}
+    if path.exists(manifest_path):
+        old_manifest = load_manifest(manifest_path)
+        if all(old_manifest.get(key, False) == manifest[key] for key in ["nb_entries", "shard_size", "row_width", "dtype", "variable_length"]):
+            manifest["shards"] = [shard for shard in old_manifest["shards"]
+                                  if path.exists(path.join(path.dirname(manifest_path), shard["file"]))]
+            logger.info(
+                f"Resuming with {len(manifest['shards'])}/{nb_shards} completed shards from {manifest_path}")
+        else:
+            logger.info(
+                f"Ignoring {manifest_path}, which was created for other entries or settings")
+
+    done = {shard["index"] for shard in manifest["shards"]}
+    jobs_args = []
+    for shard_idx in range(nb_shards):
+        if shard_idx not in done:
+            shard_path = path.join(shard_dir, f"{shard_idx:05d}.npy")
+            shard_entries = entries.iloc[shard_idx *
+                                         shard_size:(shard_idx + 1) * shard_size]
+            jobs_args.append((shard_idx, shard_entries,
+                             row_width, shard_path, variable_length))
+
+    def add_shard(shard_idx, nb_rows):
+        manifest["shards"].append({"index": shard_idx, "nb_rows": nb_rows,
+                                   "file": path.relpath(path.join(shard_dir, f"{shard_idx:05d}.npy"), path.dirname(manifest_path))})
+        manifest["shards"].sort(key=lambda shard: shard["index"])
+        store_manifest(manifest, manifest_path)
+        logger.info(
+            f"Completed {len(manifest['shards'])}/{nb_shards} shards of {manifest_path}")
+
+    init_args = (load_tokenizer_fct, iids_file, input_factory_class)
+    if jobs > 1 and len(jobs_args) > 1:
+        with Pool(min(jobs, len(jobs_args)), initializer=_init_worker, initargs=init_args) as pool:
+            for shard_idx, nb_rows in pool.imap_unordered(_vectorize_shard, jobs_args):
+                add_shard(shard_idx, nb_rows)
+    else:
+        _init_worker(*init_args)
+        for job in jobs_args:
+            add_shard(*_vectorize_shard(job))
+
+    manifest["complete"] = True
+    store_manifest(manifest, manifest_path)
+    logger.info(f"Stored {nb_shards} shards listed in {manifest_path}")
+
+
+def split_row(row, pad_token_id):
+    # a row holds the input ids, maybe followed by padding, and then
+    # max_output_length label ids; returns the input ids without padding and
+    # the label ids
+    input_ids = row[:len(row) - params.max_output_length]
+    input_ids = input_ids[:np.count_nonzero(input_ids != pad_token_id)]
+    return input_ids, row[len(row) - params.max_output_length:]
+
+
+def collate_batch(items, pad_token_id):
+    # turns (input ids, label ids) pairs into a batch of (input_ids,
+    # attention_mask, label_ids), padded only up to the longest input
+    input_ids, attention_mask = pad_and_mask(
+        [np.asarray(ids, dtype=np.int64) for ids, _ in items], pad_token_id)
+    label_ids = t.from_numpy(
+        np.stack([labels for _, labels in items]).astype(np.int64))
+    return input_ids, attention_mask, label_ids
+
+
+def length_buckets(items, length_fct, batch_size, pool_size, rng=None):
+    # Groups items of similar length into batches: collects pools of
+    # pool_size items, sorts each pool by length, and cuts it into batches,
+    # which are yielded in random order if an rng is given. Items that do not
+    # fill a batch are carried over to the next pool; the last incomplete
+    # batch is dropped.
+    pool = []
+
+    def batches_of_pool():
+        pool.sort(key=length_fct)
+        nb_batched = len(pool) // batch_size * batch_size
+        batches = [pool[start:start + batch_size]
+                   for start in range(0, nb_batched, batch_size)]
+        del pool[:nb_batched]
+        if rng is not None:
+            rng.shuffle(batches)
+        return batches
+
+    for item in items:
+        pool.append(item)
+        if len(pool) >= pool_size:
+            yield from batches_of_pool()
+    yield from batches_of_pool()
+
+
+class LengthBucketSampler(Sampler):
+    # Batch sampler over a dataset with known lengths, which yields the
+    # indices of batches of similar length (see length_buckets).
+
+    def __init__(self, lengths, batch_size, pool_size, shuffle=False):
+        self.lengths = lengths
+        self.batch_size = batch_size
+        self.pool_size = pool_size
+        self.rng = random.Random() if shuffle else None
+
+    def __len__(self):
+        return len(self.lengths) // self.batch_size
+
+    def __iter__(self):
+        indices = list(range(len(self.lengths)))
+        if self.rng is not None:
+            self.rng.shuffle(indices)
+        return length_buckets(indices, self.lengths.__getitem__,
+                              self.batch_size, self.pool_size, self.rng)
+
+
+class PaddedRows(Dataset):
+    # The rows of a tensor loaded from a .pt file, as (input ids, label ids)
+    # pairs without padding.
+
+    def __init__(self, tensor, pad_token_id):
+        self.rows = tensor.numpy()
+        self.pad_token_id = pad_token_id
+        self.lengths = (tensor[:, :tensor.shape[1] - params.max_output_length]
+                        != pad_token_id).sum(dim=1).tolist()
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, idx):
+        return split_row(self.rows[idx], self.pad_token_id)
+
+
+class ShardedDataset(IterableDataset):
+    # Streams the rows of sharded tensors. Shards are memory-mapped, so rows
+    # are read on demand, and several processes (DataLoader workers, or
+    # training processes with distinct ranks) share the same pages without
+    # copying them. With a shuffle buffer, shards are visited in a random
+    # order and rows are shuffled across the buffer, reseeded in each epoch.
+    # Each row is yielded as a 1-tuple, like the rows of a TensorDataset.
+    # With a batch_size, the dataset instead yields ready batches of rows of
+    # similar length (see collate_batch and length_buckets).
+
+    def __init__(self, manifest_path, shuffle_buffer_size=0, seed=0, rank=0, world_size=1,
+                 batch_size=None, pad_token_id=None):
+        manifest = load_manifest(manifest_path)
+        if not manifest["complete"]:
+            logger.info(f"{manifest_path} lists only some shards, using those")
+        manifest_dir = path.dirname(manifest_path)
+        self.shard_files = [path.join(manifest_dir, shard["file"])
+                            for shard in manifest["shards"]]
+        self.variable_length = manifest.get("variable_length", False)
+        self.nb_rows = sum(shard["nb_rows"] for shard in manifest["shards"])
+        self.shuffle_buffer_size = shuffle_buffer_size
+        self.seed = seed
+        self.rank = rank
+        self.world_size = world_size
+        self.batch_size = batch_size
+        self.pad_token_id = pad_token_id
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __len__(self):
+        if self.batch_size is not None:
+            return self.nb_rows // self.world_size // self.batch_size
+        return self.nb_rows // self.world_size
+
+    def _shards_of_this_worker(self):
+        shards = list(range(len(self.shard_files)))
+        if self.shuffle_buffer_size > 1:
+            # all workers and ranks use the same order, and then each takes its part
+            random.Random(self.seed + self.epoch).shuffle(shards)
+        worker_info = get_worker_info()
+        worker_id, nb_workers = (worker_info.id, worker_info.num_workers) \
+            if worker_info is not None else (0, 1)
+        nb_parts = self.world_size * nb_workers
+        part = self.rank * nb_workers + worker_id
+        return shards[part::nb_parts], (self.seed, self.epoch, part)
+
+    def _rows_of_shard(self, shard):
+        rows = np.load(self.shard_files[shard], mmap_mode="r")
+        if not self.variable_length:
+            return rows
+        offsets = np.load(offsets_file(self.shard_files[shard]))
+        return (rows[start:end] for start, end in zip(offsets[:-1], offsets[1:]))
+
+    def _rows(self, shards, rng):
+        buffer = []
+        for shard in shards:
+            for row in self._rows_of_shard(shard):
+                if self.shuffle_buffer_size <= 1:
+                    yield row.astype(np.int64)
+                    continue
+                buffer.append(row)
+                if len(buffer) >= self.shuffle_buffer_size:
+                    idx = rng.randrange(len(buffer))
+                    buffer[idx], buffer[-1] = buffer[-1], buffer[idx]
+                    yield buffer.pop().astype(np.int64)
+        rng.shuffle(buffer)
+        for row in buffer:
+            yield row.astype(np.int64)
+
+    def __iter__(self):
+        shards, rng_seed = self._shards_of_this_worker()
+        rng = random.Random(str(rng_seed))
+        rows = self._rows(shards, rng)
+        if self.batch_size is None:
+            return ((t.from_numpy(row),) for row in rows)
+
+        items = (split_row(row, self.pad_token_id) for row in rows)
+        batches = length_buckets(items, lambda item: len(item[0]), self.batch_size,
+                                 self.batch_size * params.length_bucket_pool_batches,
+                                 rng if self.shuffle_buffer_size > 1 else None)
+        return (collate_batch(batch, self.pad_token_id) for batch in batches)
+
+
+def _rank_and_world_size():
+    if t.distributed.is_available() and t.distributed.is_initialized():
+        return t.distributed.get_rank(), t.distributed.get_world_size()
+    return 0, 1
+
+
+def load_tensors(tensors_path, shuffle=False):
+    # sharded tensors (a .manifest.json file) are streamed, .pt files are loaded at once
+    if tensors_path.endswith(".manifest.json"):
+        rank, world_size = _rank_and_world_size()
+        return ShardedDataset(tensors_path, params.shuffle_buffer_size if shuffle else 0,
+                              rank=rank, world_size=world_size)
+    return TensorDataset(t.load(tensors_path))
+
+
+def _sharded_loader(dataset, batch_size):
+    # workers read and prefetch rows of their own shards in the background
+    nb_workers = min(params.data_loader_workers, len(dataset.shard_files))
+    return DataLoader(dataset, batch_size=batch_size, drop_last=batch_size is not None,
+                      num_workers=nb_workers, prefetch_factor=2 if nb_workers > 0 else None,
+                      pin_memory=t.cuda.is_available())
+
+
+def tensors_loader(dataset, batch_size):
+    if isinstance(dataset, ShardedDataset):
+        return _sharded_loader(dataset, batch_size)
+    return DataLoader(dataset, batch_size=batch_size, drop_last=True)
+
+
+def length_bucketed_loader(tensors_path, batch_size, pad_token_id, shuffle=False):
+    # Loads tensors (like load_tensors) and returns a loader of (input_ids,
+    # attention_mask, label_ids) batches, where each batch holds inputs of
+    # similar length, padded only up to the longest one.
+    if tensors_path.endswith(".manifest.json"):
+        rank, world_size = _rank_and_world_size()
+        dataset = ShardedDataset(tensors_path, params.shuffle_buffer_size if shuffle else 0,
+                                 rank=rank, world_size=world_size,
+                                 batch_size=batch_size, pad_token_id=pad_token_id)
+        # the dataset yields ready batches
+        return _sharded_loader(dataset, None)
+
+    dataset = PaddedRows(t.load(tensors_path), pad_token_id)
+    sampler = LengthBucketSampler(dataset.lengths, batch_size,
+                                  batch_size * params.length_bucket_pool_batches, shuffle)
+    return DataLoader(dataset, batch_sampler=sampler,
+                      collate_fn=partial(collate_batch, pad_token_id=pad_token_id))
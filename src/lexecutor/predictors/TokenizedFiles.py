@@ -0,0 +1,66 @@
+import itertools
+
+
+class TokenizedFiles:
+    # Caches, for each source file, its lines, the token ids of the whole
+    # file as one flat list, and the offset of each line's first token in
+    # that list. With these, the tokens of a file in which one line is
+    # modified can be sliced without re-flattening all lines.
+
+    def __init__(self, tokenizer, max_files=10000):
+        self.tokenizer = tokenizer
+        self.max_files = max_files
+        self.file_to_tokens = {}
+
+    def get(self, file_name):
+        # returns (lines, flat token ids, line offsets)
+        tokens = self.file_to_tokens.get(file_name)
+        if tokens is None:
+            with open(file_name, "r") as f:
+                lines = f.readlines()
+            tokenized_lines = self.tokenizer(
+                lines, return_attention_mask=False, add_special_tokens=False).input_ids
+            line_offsets = [0] + \
+                list(itertools.accumulate(len(ids) for ids in tokenized_lines))
+            token_ids = list(itertools.chain(*tokenized_lines))
+            tokens = (lines, token_ids, line_offsets)
+
+            if len(self.file_to_tokens) >= self.max_files:  # prevent OOM
+                self.file_to_tokens = {}
+            self.file_to_tokens[file_name] = tokens
+        return tokens
+
+
+def context_window(token_ids, line_offsets, line_idx, line_ids, target_idx):
+    # Returns the (at most 512) tokens before and after the target, in the
+    # token ids of a file where the line at line_idx is replaced by line_ids
+    # and the target is the token at target_idx of line_ids. Selects the same
+    # window as InputFactory._extract_context_window on the re-flattened file.
+    line_begin, line_end = line_offsets[line_idx], line_offsets[line_idx + 1]
+    total = len(token_ids) - (line_end - line_begin) + len(line_ids)
+    target = line_begin + target_idx
+
+    if target < 255:
+        start, stop = 0, 512
+    elif target + 255 > total:
+        start, stop = total - 512, total
+        if start < 0:
+            # negative slice starts count from the end
+            start = max(start + total, 0)
+        start = min(start, target)
+    else:
+        start, stop = target - 255, target + 255
+    stop = min(stop, total)
+
+    def virtual_slice(begin, end):
+        # slice of token_ids[:line_begin] + line_ids + token_ids[line_end:]
+        modified_end = line_begin + len(line_ids)
+        ids = token_ids[begin:min(end, line_begin)] if begin < line_begin else []
+        if begin < modified_end and end > line_begin:
+            ids += line_ids[max(begin - line_begin, 0):min(end, modified_end) - line_begin]
+        if end > modified_end:
+            shift = line_end - modified_end
+            ids += token_ids[max(begin, modified_end) + shift:end + shift]
+        return ids
+
+    return virtual_slice(start, target), virtual_slice(target, stop)
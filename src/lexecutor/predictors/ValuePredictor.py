@@ -2,6 +2,9 @@ from abc import ABC
 
 
 class ValuePredictor(ABC):
+    def prefetch(self, file):
+        pass
+
     def name(self, iid, name):
         pass
 
@@ -5,8 +5,10 @@ from ..ValuePredictor import ValuePredictor
 from ..DLUtil import device
 from .CodeBERT import load_CodeBERT
 from .InputFactory import InputFactory
+from .FillMaskEngine import FillMaskEngine
+from ..PredictionCache import PredictionCache
 from ...Logging import logger
-from transformers import pipeline
+import atexit
 import time
 import requests
 from requests.exceptions import ConnectionError
@@ -30,12 +32,20 @@ class CodeBERTValuePredictor(ValuePredictor):
         self.model.load_state_dict(t.load(
             model_path, map_location=device))
         self.model.to(device)
+        self.model.eval()
+        self.engine = FillMaskEngine(self.model, self.tokenizer)
         logger.info("CodeBERT model loaded")
 
         self.iids = IIDs(params.iids_file)
         self.stats = stats
         self.input_factory = InputFactory(self.iids, self.tokenizer)
 
+        if params.prediction_cache_dir is not None:
+            self.cache = PredictionCache(params.iids_file, model_path)
+            atexit.register(self.cache.store)
+        else:
+            self.cache = None
+
     def _fetch_model(self, model_path):
         path_to_url = {
             "data/released_models/codebert_model_20232906_fine-grained.bin": "https://github.com/michaelpradel/LExecutor/releases/download/Models_20230105/codebert_model_20232906_fine-grained.bin",
@@ -49,28 +59,22 @@ class CodeBERTValuePredictor(ValuePredictor):
         open(model_path, 'wb').write(request.content)
 
     def _query_model(self, entry):
-        # turn entry into vectors
-        input_ids, _ = self.input_factory.entry_to_inputs(entry)
-        input_ids = [tensor.to(device) for tensor in input_ids]
+        if self.cache is not None:
+            val_as_string = self.cache.get(
+                entry["iid"], entry["kind"], entry["name"])
+            if val_as_string is not None:
+                return val_as_string, restore_value(val_as_string)
 
-        # query the model and decode the result
+        # turn entry into vectors and query the model
+        input_ids, _ = self.input_factory.entry_to_inputs(entry)
         with t.no_grad():
-            self.model.eval()
-
-            fill_mask = pipeline('fill-mask', model=self.model, tokenizer=self.tokenizer, device=0, framework="pt")
-
-            # This is required because the fill-mask pipeline adds special tokens during encoding.
-            # If use skip_special_tokens=True, <mask> is discarded as well
-            INPUT = self.tokenizer.decode(input_ids)
-            INPUT = INPUT.replace("</s>", "")
-            INPUT = INPUT.replace("<s>", "")
-            INPUT = INPUT.replace("<pad>", "")
-
-            predictions = fill_mask(INPUT)
-
-        val_as_string = predictions[0]['token_str']
+            val_as_string = self.engine.predict(input_ids.unsqueeze(0))[0]
         val = restore_value(val_as_string)
 
+        if self.cache is not None:
+            self.cache.put(entry["iid"], entry["kind"],
+                           entry["name"], val_as_string)
+
         return val_as_string, val
 
     def name(self, iid, name):
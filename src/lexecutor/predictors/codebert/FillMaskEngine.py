@@ -0,0 +1,50 @@
+import torch as t
+from ..DLUtil import device
+from .CodeBERT import value_tokens
+
+
+class FillMaskEngine:
+    # Predicts the value at the <mask> of inputs encoded by the InputFactory,
+    # without decoding and re-tokenizing them (as a fill-mask pipeline
+    # would): runs the encoder on a batch of input ids, applies the MLM head
+    # only to the hidden state at each input's mask position, and takes the
+    # softmax over the value tokens only.
+
+    def __init__(self, model, tokenizer):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.value_tokens = value_tokens
+        self.value_token_ids = t.tensor(
+            tokenizer.convert_tokens_to_ids(value_tokens), device=device)
+
+    def mask_positions(self, input_ids):
+        # the position of the <mask> in each input
+        is_mask = input_ids == self.tokenizer.mask_token_id
+        assert (is_mask.sum(dim=1) == 1).all(), \
+            "Each input must contain exactly one <mask>"
+        return is_mask.int().argmax(dim=1)
+
+    def probabilities(self, input_ids):
+        # returns a [nb_inputs, nb_value_tokens] tensor of probabilities
+        input_ids = input_ids.to(device)
+        attention_mask = (input_ids != self.tokenizer.pad_token_id).long()
+        hidden_states = self.model.roberta(
+            input_ids=input_ids, attention_mask=attention_mask).last_hidden_state
+        masked_states = hidden_states[t.arange(
+            len(input_ids), device=device), self.mask_positions(input_ids)]
+        logits = self.model.lm_head(masked_states)[:, self.value_token_ids]
+        return t.softmax(logits, dim=1)
+
+    def top_k(self, input_ids, k):
+        # the k most likely value tokens of each input, as lists of
+        # (token id, value, probability)
+        probabilities, idxs = self.probabilities(input_ids).topk(
+            min(k, len(self.value_tokens)), dim=1)
+        token_ids = self.value_token_ids[idxs]
+        return [[(token_id, self.value_tokens[idx], probability)
+                 for token_id, idx, probability in zip(row_token_ids, row_idxs, row_probabilities)]
+                for row_token_ids, row_idxs, row_probabilities in zip(token_ids.tolist(), idxs.tolist(), probabilities.tolist())]
+
+    def predict(self, input_ids):
+        # the most likely value of each input
+        return [top[0][1] for top in self.top_k(input_ids, 1)]
@@ -5,19 +5,20 @@ import torch as t
 import csv
 import pandas as pd
 import numpy as np
-from torch.utils.data import DataLoader, TensorDataset
-from transformers import AdamW, pipeline
+from transformers import AdamW
 from .CodeBERT import load_CodeBERT
+from .FillMaskEngine import FillMaskEngine
 from ...Hyperparams import Hyperparams as params
 from ..DLUtil import device
+from ..ShardedTensors import load_tensors, tensors_loader
 from ...Logging import logger
 
 
 parser = argparse.ArgumentParser()
 parser.add_argument(
-    "--train_tensors", help=".pt files for training", default="train.pt")
+    "--train_tensors", help=".pt file or .manifest.json file of sharded tensors for training", default="train.pt")
 parser.add_argument(
-    "--validate_tensors", help=".pt files for validation", default="validate.pt")
+    "--validate_tensors", help=".pt file or .manifest.json file of sharded tensors for validation", default="validate.pt")
 parser.add_argument(
     "--output_dir", help="directory to store models", required=True)
 
@@ -26,9 +27,8 @@ print_examples = True
 
 
 def evaluate(validate_tensors_path, model, tokenizer):
-    validate_dataset = TensorDataset(t.load(validate_tensors_path))
-    validate_loader = DataLoader(
-        validate_dataset, batch_size=params.batch_size_CodeBERT, drop_last=True)
+    validate_dataset = load_tensors(validate_tensors_path)
+    validate_loader = tensors_loader(validate_dataset, params.batch_size_CodeBERT)
 
     logger.info("Starting evaluation")
     logger.info("  Num examples = {}".format(len(validate_dataset)))
@@ -44,7 +44,7 @@ def evaluate(validate_tensors_path, model, tokenizer):
     with t.no_grad():
         model.eval()
 
-        fill_mask = pipeline('fill-mask', model=model, tokenizer=tokenizer, device=0, framework="pt")
+        engine = FillMaskEngine(model, tokenizer)
 
         for batch_idx, batch in enumerate(validate_loader):
             print(f"Batch: {batch_idx}")
@@ -57,29 +57,16 @@ def evaluate(validate_tensors_path, model, tokenizer):
             labels = tokenizer.batch_decode(
                 label_ids, skip_special_tokens=True)
 
-            # combine top-most prediction obtained via normal sampling and top-2, top-3, etc. predictions obtained via top-p nucleus sampling
-            # 1) top-most prediction obtained via normal sampling
+            # the label is the value token at the mask position
+            mask_positions = engine.mask_positions(input_ids)
+            label_token_ids = label_ids[t.arange(
+                len(label_ids), device=device), mask_positions].tolist()
 
-            masked_index = t.nonzero(input_ids == tokenizer.mask_token_id, as_tuple=False)
-
-            # This is required because the fill-mask pipeline adds special tokens during encoding.
-            # If use skip_special_tokens=True, <mask> is discarded as well
-            INPUT = tokenizer.batch_decode(input_ids)
-            for i in range(len(INPUT)):
-                input = INPUT[i].replace("</s>", "")
-                input = input.replace("<s>", "")
-                input = input.replace("<pad>", "")
-                INPUT[i] = input
-
-            predictions = fill_mask(INPUT)
-
-            corrects = [1 for i in range(
-                len(labels)) if label_ids[i][int(masked_index[i][1])] == predictions[i][0]['token']]
-            top1_accuracy = float(len(corrects)) / len(labels)
-            k_to_all_accuracies[1].append(top1_accuracy)
+            # rank the value tokens at the mask position
+            predictions = engine.top_k(input_ids, k_max)
 
             # for debugging/eye-balling the results
-            all_inputs.extend(INPUT)
+            all_inputs.extend(tokenizer.batch_decode(input_ids))
             all_labels.extend(labels)
             all_predictions.extend(predictions)
             if print_examples:
@@ -89,18 +76,13 @@ def evaluate(validate_tensors_path, model, tokenizer):
                         logger.info(
                             f"Label: {label}, Prediction: {prediction}")
 
-            # 2) count correct predictions among different top-k (top-2, top-3, etc.)
+            # count correct predictions among different top-k
             k_to_corrects = {k: 0 for k in range(1, k_max+1)}
-            # for top-1, use regular predictions from above
-            k_to_corrects[1] = len(corrects)
-            i = 0
-            while i < len(labels):
-                topk_predictions_for_example = [prediction['token'] for prediction in predictions[i][:k_max]]
-                label_for_example = label_ids[i][int(masked_index[i][1])]
-                for k in range(2, k_max+1):
-                    if label_for_example in topk_predictions_for_example[:k]:
+            for label_token_id, topk in zip(label_token_ids, predictions):
+                topk_token_ids = [token_id for token_id, _, _ in topk]
+                for k in range(1, k_max+1):
+                    if label_token_id in topk_token_ids[:k]:
                         k_to_corrects[k] += 1
-                i += 1
 
             # compute top-k accuracies
             for k, corrects in k_to_corrects.items():
@@ -135,9 +117,8 @@ if __name__ == "__main__":
 
     tokenizer, model = load_CodeBERT()
 
-    train_dataset = TensorDataset(t.load(args.train_tensors))
-    train_loader = DataLoader(
-        train_dataset, batch_size=params.batch_size_CodeBERT, drop_last=True)
+    train_dataset = load_tensors(args.train_tensors, shuffle=True)
+    train_loader = tensors_loader(train_dataset, params.batch_size_CodeBERT)
 
     optim = AdamW(model.parameters(), lr=1e-5)
 
@@ -156,6 +137,8 @@ if __name__ == "__main__":
 
     for epoch in range(params.epochs):
         logger.info(f"Epoch {epoch}")
+        if hasattr(train_dataset, "set_epoch"):
+            train_dataset.set_epoch(epoch)
 
         for batch_idx, batch in enumerate(train_loader):
             batch = t.cat(batch)
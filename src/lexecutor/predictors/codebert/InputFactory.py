@@ -5,6 +5,7 @@ import torch as t
 from ..DLUtil import dtype, device
 from ...Logging import logger
 from ...Hyperparams import Hyperparams as params
+from ..TokenizedFiles import TokenizedFiles, context_window
 
 
 # special tokens
@@ -31,6 +32,14 @@ class InputFactory(object):
             kind_attribute_token, add_special_tokens=False, return_attention_mask=False).input_ids[0]
         self.sep_token_id = self.tokenizer(
             sep_token, add_special_tokens=False, return_attention_mask=False).input_ids[0]
+        self.mask_token_id = self.tokenizer.encode(mask_token)[1]
+        self.kind_to_token_id = {"name": self.kind_name_token_id,
+                                 "call": self.kind_call_token_id,
+                                 "attribute": self.kind_attribute_token_id}
+
+        # for the batch path
+        self.tokenized_files = TokenizedFiles(tokenizer)
+        self.value_to_label_ids = {}
 
     def __tokenize_lines(self, file_name):
         if file_name in self.file_to_tokenized_lines:
@@ -81,6 +90,9 @@ class InputFactory(object):
             assert entry["value"].startswith("@"), entry["value"]
             value = entry["value"][1:]
 
+        return self._tokenize_value(value)
+
+    def _tokenize_value(self, value):
         label_ids = self.tokenizer(
             value, max_length=1, 
             return_attention_mask=False, add_special_tokens=False).input_ids
@@ -115,63 +127,70 @@ class InputFactory(object):
         mask_value_ids = self._encode_output(entry)
         previous_target_tokens, after_target_tokens = self._extract_context_window(
             token_ids, mask_token)
-        
+
+        input_ids, output_ids, previous_target_tokens, after_target_tokens = self._assemble_input_output(
+            name_ids, entry["kind"], previous_target_tokens, after_target_tokens, mask_value_ids)
+
+        # guarantee that the input fits 512 tokens even after decoding and encoding again
+        while not self._fit_after_roundtrip([input_ids])[0]:
+            input_ids = self._shortened_input(
+                name_ids, entry["kind"], previous_target_tokens, after_target_tokens)
+
+        # Add padding
+        if len(input_ids) < 512:
+            input_ids = input_ids + \
+                (512 - len(input_ids)) * [self.tokenizer.pad_token_id]
+
+        return input_ids, output_ids
+
+    def _assemble_input_output(self, name_ids, kind, previous_target_tokens, after_target_tokens, mask_value_ids):
+        # returns the (unpadded) input ids, the padded output ids, and the shrunk context
+
         # shrink context to fit everything (incl. the variable-sized name_ids) into 512 tokens
         while len(name_ids) + len(mask_value_ids) + len(previous_target_tokens) + len(after_target_tokens[1:]) + 5 > 512:
             previous_target_tokens = previous_target_tokens[1:]
             after_target_tokens = after_target_tokens[:-1]
-        context_ids = previous_target_tokens + [self.tokenizer.encode(mask_token)[1]] + after_target_tokens[1:]
-
-        if entry["kind"] == "name":
-            kind_token = self.kind_name_token_id
-        elif entry["kind"] == "call":
-            kind_token = self.kind_call_token_id
-        elif entry["kind"] == "attribute":
-            kind_token = self.kind_attribute_token_id
-            
+        context_ids = previous_target_tokens + [self.mask_token_id] + after_target_tokens[1:]
+
+        kind_token = self.kind_to_token_id[kind]
+
         input_ids = [self.tokenizer.bos_token_id] + \
             name_ids + \
             [self.sep_token_id, kind_token, self.sep_token_id] + \
             context_ids + \
             [self.tokenizer.eos_token_id]
-        
-        # guarantee that the input fits 512 tokens even after decoding and encoding again
-        while True:
-            decoded_input = self.tokenizer.decode(input_ids)
-            decoded_input = decoded_input.replace("</s>", "")
-            decoded_input = decoded_input.replace("<s>", "")
-            decoded_input = decoded_input.replace("<pad>", "")
-            encoded_input = self.tokenizer.encode(decoded_input)
-            if len(encoded_input[1:-1]) > 510:
-                input_ids = [self.tokenizer.bos_token_id] + \
-                name_ids + \
-                [self.sep_token_id, kind_token, self.sep_token_id] + \
-                previous_target_tokens[1:0] + [self.tokenizer.encode(mask_token)[1]] + after_target_tokens[1:-1] + \
-                [self.tokenizer.eos_token_id]
-            else:
-                break
 
-        # Add padding
-        if len(input_ids) < 512:
-            input_ids = input_ids + \
-                (512 - len(input_ids)) * [self.tokenizer.pad_token_id]
-            
         output_ids = [self.tokenizer.bos_token_id] + \
             name_ids + \
             [self.sep_token_id, kind_token, self.sep_token_id] + \
             previous_target_tokens + mask_value_ids + after_target_tokens[1:] + \
             [self.tokenizer.eos_token_id]
-        
+
         # Add padding
         if len(output_ids) < 512:
             output_ids = output_ids + \
                 (512 - len(output_ids)) * [self.tokenizer.pad_token_id]
 
-        return input_ids, output_ids
+        return input_ids, output_ids, previous_target_tokens, after_target_tokens
+
+    def _fit_after_roundtrip(self, all_input_ids):
+        # checks which inputs still fit 512 tokens after decoding and encoding them again
+        decoded_inputs = self.tokenizer.batch_decode(all_input_ids)
+        decoded_inputs = [decoded_input.replace("</s>", "").replace("<s>", "").replace("<pad>", "")
+                          for decoded_input in decoded_inputs]
+        encoded_inputs = self.tokenizer(decoded_inputs).input_ids
+        return [len(encoded_input[1:-1]) <= 510 for encoded_input in encoded_inputs]
+
+    def _shortened_input(self, name_ids, kind, previous_target_tokens, after_target_tokens):
+        return [self.tokenizer.bos_token_id] + \
+            name_ids + \
+            [self.sep_token_id, self.kind_to_token_id[kind], self.sep_token_id] + \
+            previous_target_tokens[1:0] + [self.mask_token_id] + after_target_tokens[1:-1] + \
+            [self.tokenizer.eos_token_id]
 
 
     def entry_to_inputs(self, entry):
-        location = self.iids.location(str(entry["iid"]))
+        location = self.iids.location(entry["iid"])
 
         lines, tokenized_lines = self.__tokenize_lines(location.file+'.orig')
 
@@ -184,3 +203,80 @@ class InputFactory(object):
         assert len(label_ids) == 512, len(label_ids)
 
         return input_ids, label_ids
+
+    def entries_to_inputs(self, entries, out, chunk_size=10000):
+        # Batch version of entry_to_inputs for a DataFrame of entries: writes
+        # the input ids and output ids of the i-th entry into out[i], a
+        # preallocated integer array of shape [len(entries), 1024].
+        # Entries are processed file by file, so that each file is read,
+        # tokenized, and flattened once, and the modified target lines, the
+        # names, and the decode-encode round trips of a chunk of entries are
+        # done with one tokenizer call each.
+        names = entries["name"].tolist()
+        kinds = entries["kind"].tolist()
+        values = entries["value"].tolist() if "value" in entries else None
+        locations = [self.iids.location(iid) for iid in entries["iid"]]
+        rows = sorted(range(len(locations)), key=lambda row: locations[row].file)
+
+        for chunk_start in range(0, len(rows), chunk_size):
+            chunk_rows = rows[chunk_start:chunk_start + chunk_size]
+
+            modified_lines = []
+            for row in chunk_rows:
+                location = locations[row]
+                lines, _, _ = self.tokenized_files.get(location.file+'.orig')
+                target_line = lines[location.line-1]
+                modified_lines.append(target_line[:location.column_start] +
+                                      mask_token + target_line[location.column_end:])
+            tokenized_target_lines = self.tokenizer(
+                modified_lines, return_attention_mask=False, add_special_tokens=False).input_ids
+            all_name_ids = self.tokenizer([names[row] for row in chunk_rows],
+                                          return_attention_mask=False, add_special_tokens=False).input_ids
+
+            all_input_ids = []
+            contexts = []
+            for row, tokenized_target_line, name_ids in zip(chunk_rows, tokenized_target_lines, all_name_ids):
+                location = locations[row]
+                _, token_ids, line_offsets = self.tokenized_files.get(
+                    location.file+'.orig')
+                previous_target_tokens, after_target_tokens = context_window(
+                    token_ids, line_offsets, location.line-1, tokenized_target_line,
+                    tokenized_target_line.index(self.mask_token_id))
+                mask_value_ids = self._label_ids(
+                    values[row] if values is not None else None)
+
+                input_ids, output_ids, previous_target_tokens, after_target_tokens = self._assemble_input_output(
+                    name_ids, kinds[row], previous_target_tokens, after_target_tokens, mask_value_ids)
+                out[row, 512:] = output_ids
+                all_input_ids.append(input_ids)
+                contexts.append((previous_target_tokens, after_target_tokens))
+
+            # guarantee that the inputs fit 512 tokens even after decoding and encoding again
+            fits = self._fit_after_roundtrip(all_input_ids)
+            for row, input_ids, name_ids, (previous_target_tokens, after_target_tokens), fit in zip(
+                    chunk_rows, all_input_ids, all_name_ids, contexts, fits):
+                while not fit:
+                    input_ids = self._shortened_input(
+                        name_ids, kinds[row], previous_target_tokens, after_target_tokens)
+                    fit = self._fit_after_roundtrip([input_ids])[0]
+
+                # Add padding
+                out[row, :len(input_ids)] = input_ids
+                out[row, len(input_ids):512] = self.tokenizer.pad_token_id
+
+            logger.info(
+                f"Vectorized {min(chunk_start + chunk_size, len(rows))}/{len(rows)} entries")
+
+    def _label_ids(self, value):
+        # like _encode_output, but each distinct value is tokenized only once
+        label_ids = self.value_to_label_ids.get(value)
+        if label_ids is None:
+            if value is None:
+                # during prediction
+                label_ids = self._tokenize_value("unknown")
+            else:
+                # during training
+                assert value.startswith("@"), value
+                label_ids = self._tokenize_value(value[1:])
+            self.value_to_label_ids[value] = label_ids
+        return label_ids
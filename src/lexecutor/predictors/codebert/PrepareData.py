@@ -1,15 +1,17 @@
 import argparse
-import multiprocessing
+from os import path
 import pandas as pd
 import numpy as np
 import torch as t
 from ...Logging import logger
 from ...Util import gather_files
-from .CodeBERT import load_CodeBERT
+from ...TraceReader import read_trace
+from .CodeBERT import load_CodeBERT, load_CodeBERT_tokenizer
 from ...Hyperparams import Hyperparams as params
 from ...IIDs import IIDs
 from .InputFactory import InputFactory
 from ...ValueAbstraction import fine_to_coarse_grained
+from ..ShardedTensors import manifest_file, entries_file, store_entries, prepare_shards
 
 
 parser = argparse.ArgumentParser()
@@ -22,14 +24,18 @@ parser.add_argument(
     "--output_dir", help="directory to store tensors", required=True)
 parser.add_argument(
     "--output_suffix", help="Suffix to append to output file names (if nothing given: train.pt, validate.pt)")
+parser.add_argument(
+    "--shard_size", help="Store the tensors as shards with this many entries each, plus a manifest (resumes an interrupted job)", type=int)
+parser.add_argument(
+    "--jobs", help="Number of processes that vectorize shards in parallel", type=int, default=1)
 
 
 def read_traces(trace_files):
     logger.info("Loading trace files")
     df = pd.DataFrame(data=None)
-    trace_files = gather_files(trace_files, suffix=".h5")
+    trace_files = gather_files(trace_files, suffix=(".arrow", ".h5"))
     for trace_file in trace_files:
-        current_df = pd.read_hdf(trace_file, key="entries")
+        current_df = read_trace(trace_file)
         df = pd.concat([df, current_df])
     return df
 
@@ -95,14 +101,9 @@ def split_and_shuffle(entries, iids):
 def gather_context_and_vectorize(entries, iids, tokenizer):
     factory = InputFactory(iids, tokenizer)
 
-    all_vectorized = t.empty(
-        [len(entries), 1024], dtype=t.long)
-    for index, entry in entries.iterrows():
-        input_ids, label_ids = factory.entry_to_inputs(entry)
-        all_vectorized[index] = t.cat([input_ids, label_ids])
-
-        if index % 10000 == 0:
-            logger.info(f"Vectorized {index}/{len(entries)} entries")
+    all_vectorized = np.empty([len(entries), 1024], dtype=np.int64)
+    factory.entries_to_inputs(entries, all_vectorized)
+    all_vectorized = t.from_numpy(all_vectorized)
 
     logger.info(f"Created tensor of shape {all_vectorized.shape}")
     return all_vectorized
@@ -116,20 +117,45 @@ def store_tensors(train_tensors, validate_tensors, output_dir, output_suffix):
     logger.info(f"Stored tensors to {train_path} and {validate_path}")
 
 
-if __name__ == "__main__":
-    args = parser.parse_args()
-    tokenizer, model = load_CodeBERT()
-
-    iids = IIDs(args.iids)
+def prepare_entries(args, iids):
     entries = read_traces(args.traces)
     abstract_trace_entries(entries)
     dedup_trace_entries(entries)
     clean_entries(entries)
-    train_entries, validate_entries = split_and_shuffle(entries, iids)
+    return split_and_shuffle(entries, iids)
+
+
+def prepare_sharded_tensors(args):
+    entries_files = [entries_file(args.output_dir, split, args.output_suffix)
+                     for split in ["train", "validate"]]
+    if all(path.exists(f) for f in entries_files):
+        logger.info("Resuming with previously split entries")
+        train_entries, validate_entries = [
+            pd.read_parquet(f) for f in entries_files]
+    else:
+        train_entries, validate_entries = prepare_entries(args, IIDs(args.iids))
+        store_entries(train_entries, entries_files[0])
+        store_entries(validate_entries, entries_files[1])
+
+    for split, split_entries in [("train", train_entries), ("validate", validate_entries)]:
+        prepare_shards(split_entries, manifest_file(args.output_dir, split, args.output_suffix),
+                       args.shard_size, 1024, args.jobs,
+                       load_CodeBERT_tokenizer, args.iids, InputFactory)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    if args.shard_size is not None:
+        prepare_sharded_tensors(args)
+    else:
+        tokenizer, model = load_CodeBERT()
+
+        iids = IIDs(args.iids)
+        train_entries, validate_entries = prepare_entries(args, iids)
 
-    train_tensors = gather_context_and_vectorize(
-        train_entries, iids, tokenizer)
-    validate_tensors = gather_context_and_vectorize(
-        validate_entries, iids, tokenizer)
+        train_tensors = gather_context_and_vectorize(
+            train_entries, iids, tokenizer)
+        validate_tensors = gather_context_and_vectorize(
+            validate_entries, iids, tokenizer)
 
-    store_tensors(train_tensors, validate_tensors, args.output_dir, args.output_suffix)
+        store_tensors(train_tensors, validate_tensors, args.output_dir, args.output_suffix)
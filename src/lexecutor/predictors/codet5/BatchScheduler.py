@@ -0,0 +1,118 @@
+from collections import Counter
+import queue
+import threading
+import time
+from ...Logging import logger
+
+
+# upper bounds of the histogram buckets
+batch_size_buckets = [1, 2, 4, 8, 16, 32, 64, 128, 256, 512]
+latency_ms_buckets = [0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000]
+
+
+def _bucket(value, buckets):
+    for upper_bound in buckets:
+        if value <= upper_bound:
+            return upper_bound
+    return float("inf")
+
+
+def _format_histogram(counter, buckets, unit):
+    parts = []
+    lower_bound = 0
+    for upper_bound in buckets + [float("inf")]:
+        count = counter[upper_bound]
+        if count > 0:
+            parts.append(f"({lower_bound}, {upper_bound}]{unit}: {count}")
+        lower_bound = upper_bound
+    return ", ".join(parts)
+
+
+class _Request:
+    def __init__(self, entries):
+        self.entries = entries
+        self.submit_time = time.perf_counter()
+        self.done = threading.Event()
+        self.predicted_values = None
+        self.error = None
+
+
+class BatchScheduler:
+    # Groups the queries of concurrent clients into micro-batches: after the
+    # first query arrives, waits for at most window_ms or until max_items
+    # entries are queued, and then predicts all of them with one model call.
+
+    def __init__(self, predict_fct, window_ms, max_items, report_every=1000):
+        self.predict_fct = predict_fct
+        self.window = window_ms / 1000
+        self.max_items = max_items
+        self.report_every = report_every
+
+        self.queue = queue.Queue()
+        self.batch_sizes = Counter()
+        self.queue_latencies = Counter()
+        self.nb_batches = 0
+
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, entries):
+        # called by client handler threads; blocks until the values are predicted
+        request = _Request(entries)
+        self.queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.predicted_values
+
+    def _run(self):
+        while True:
+            requests = [self.queue.get()]
+            nb_items = len(requests[0].entries)
+            deadline = time.perf_counter() + self.window
+            while nb_items < self.max_items:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                requests.append(request)
+                nb_items += len(request.entries)
+            self._process(requests)
+
+    def _process(self, requests):
+        start_time = time.perf_counter()
+        all_entries = []
+        for request in requests:
+            self.queue_latencies[_bucket(
+                (start_time - request.submit_time) * 1000, latency_ms_buckets)] += 1
+            all_entries.extend(request.entries)
+        self.batch_sizes[_bucket(len(all_entries), batch_size_buckets)] += 1
+
+        try:
+            all_values = self.predict_fct(all_entries)
+        except Exception as e:
+            for request in requests:
+                request.error = e
+                request.done.set()
+            return
+
+        # send each caller its own results
+        offset = 0
+        for request in requests:
+            request.predicted_values = all_values[offset:offset +
+                                                  len(request.entries)]
+            offset += len(request.entries)
+            request.done.set()
+
+        self.nb_batches += 1
+        if self.nb_batches % self.report_every == 0:
+            self.report()
+
+    def report(self):
+        logger.info(f"Micro-batching stats after {self.nb_batches} batches")
+        logger.info(
+            f"  Batch sizes: {_format_histogram(self.batch_sizes, batch_size_buckets, '')}")
+        logger.info(
+            f"  Queue latencies: {_format_histogram(self.queue_latencies, latency_ms_buckets, 'ms')}")
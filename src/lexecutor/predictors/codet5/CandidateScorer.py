@@ -0,0 +1,67 @@
+import torch as t
+from ...Hyperparams import Hyperparams as params
+from ...ValueAbstraction import fine_to_coarse_grained
+
+
+def candidate_values():
+    # the values CodeT5 is trained to predict, i.e., the abstract values
+    # of the current value abstraction without their "@"
+    if params.value_abstraction == "fine-grained":
+        values = fine_to_coarse_grained.keys()
+    else:
+        values = dict.fromkeys(fine_to_coarse_grained.values())
+    return [value[1:] for value in values]
+
+
+class CandidateScorer:
+    # Ranks the closed set of values that CodeT5 can predict, instead of
+    # generating them token by token: runs the encoder once per input, and
+    # then the decoder once on all (input, candidate) pairs, teacher-forced
+    # with the candidate's label ids. The log-probabilities of a candidate's
+    # tokens add up to its score, and a softmax over the scores of all
+    # candidates gives their probabilities. The encoder and decoder are run
+    # by an InferenceBackend.
+
+    def __init__(self, backend, tokenizer, candidates=None):
+        self.backend = backend
+        self.candidates = candidates if candidates is not None else candidate_values()
+
+        # same label ids as in training (see InputFactory._tokenize_value and
+        # FineTune), i.e., only the positions the model was trained on
+        label_ids = tokenizer(self.candidates, padding=True, truncation=True,
+                              max_length=params.max_output_length, return_tensors="pt").input_ids
+        label_ids = label_ids[:, 0:params.nb_trained_label_ids]
+        self.label_ids = label_ids.to(backend.device)
+        self.label_mask = (label_ids != tokenizer.pad_token_id).to(backend.device)
+        # the decoder predicts each label id from the preceding ones
+        self.decoder_input_ids = t.cat([t.full((len(label_ids), 1), backend.decoder_start_token_id),
+                                        label_ids[:, :-1]], dim=1).to(backend.device)
+
+    def probabilities(self, input_ids, attention_mask):
+        # returns a [nb_inputs, nb_candidates] tensor of probabilities;
+        # inputs are scored in chunks to bound the size of the decoder's logits
+        chunk_size = max(1, params.max_scored_pairs // len(self.candidates))
+        return t.cat([self._probabilities(input_ids[start:start+chunk_size],
+                                          attention_mask[start:start+chunk_size])
+                      for start in range(0, len(input_ids), chunk_size)])
+
+    def _probabilities(self, input_ids, attention_mask):
+        nb_inputs, nb_candidates = len(input_ids), len(self.candidates)
+        encoder_states = self.backend.encode(input_ids, attention_mask)
+
+        # pair each input with each candidate
+        logits = self.backend.decode(self.decoder_input_ids.repeat(nb_inputs, 1),
+                                     encoder_states.repeat_interleave(
+                                         nb_candidates, dim=0),
+                                     attention_mask.repeat_interleave(nb_candidates, dim=0))
+        token_log_probs = t.log_softmax(logits, dim=-1).gather(
+            2, self.label_ids.repeat(nb_inputs, 1).unsqueeze(2)).squeeze(2)
+        scores = (token_log_probs * self.label_mask.repeat(nb_inputs, 1)).sum(dim=1)
+        return t.softmax(scores.view(nb_inputs, nb_candidates), dim=1)
+
+    def top_k(self, input_ids, attention_mask, k):
+        # the k most likely candidates of each input, as lists of (value, probability)
+        probabilities, candidate_idxs = self.probabilities(input_ids, attention_mask).topk(
+            min(k, len(self.candidates)), dim=1)
+        return [[(self.candidates[idx], probability) for idx, probability in zip(idxs, probs)]
+                for idxs, probs in zip(candidate_idxs.tolist(), probabilities.tolist())]
@@ -3,10 +3,14 @@ from ...Logging import logger
 from ..DLUtil import device
 
 
+def load_CodeT5_tokenizer():
+    return AutoTokenizer.from_pretrained('Salesforce/codet5-small')
+
+
 def load_CodeT5():
     logger.info("Loading pre-trained codet5-small")
     
-    tokenizer = AutoTokenizer.from_pretrained('Salesforce/codet5-small')
+    tokenizer = load_CodeT5_tokenizer()
     
     # logger.info(f"Special tokens: {tokenizer.all_special_tokens=}")
     # logger.info(f"Input ids of special tokens: {tokenizer.all_special_ids=}")
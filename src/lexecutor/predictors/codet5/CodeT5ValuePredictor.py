@@ -1,10 +1,14 @@
 from ..ValuePredictor import ValuePredictor
 from ..DLUtil import device
-from .ModelServer import ModelServer
+from .ModelServer import ModelServer, get_model_path
+from .Transport import connect, send_frame, recv_frame
+from ..PredictionCache import PredictionCache
+from ..Prefetch import gather_entries
+from ...IIDs import IIDs
 from ...Logging import logger
+from ...Hyperparams import Hyperparams as params
+import atexit
 import time
-import requests
-from requests.exceptions import ConnectionError
 import subprocess
 from ...ValueAbstraction import restore_value
 
@@ -13,19 +17,22 @@ class CodeT5ValuePredictor(ValuePredictor):
     def __init__(self, stats):
         self.stats = stats
 
-    def _query_model(self, entry):
-        def get(entry):
-            raw_response = requests.get(
-                "http://localhost:5000/query", params=entry)
-            if raw_response.status_code != 200:
-                raise RuntimeError(
-                    f"Model server returned error code {raw_response.status_code}")
-            return raw_response.json()
-
-        response = None
+        if params.prediction_cache_dir is not None:
+            self.cache = PredictionCache(params.iids_file, get_model_path())
+            atexit.register(self.cache.store)
+        else:
+            self.cache = None
+
+        # (iid, kind, name) -> abstract value, filled by prefetch()
+        self.prefetched = {}
+
+        # persistent connection to the model server, opened on the first query
+        self.connection = None
+
+    def _connect(self):
         try:
-            response = get(entry)
-        except ConnectionError:
+            return connect(params.model_server_socket)
+        except (FileNotFoundError, ConnectionRefusedError):
             # model server not yet running; start it
             logger.info("No model server running. Starting it now")
             server_log = open("model_server.log", "w")
@@ -37,21 +44,87 @@ class CodeT5ValuePredictor(ValuePredictor):
             attempts = 0
             while attempts < 5:
                 try:
-                    response = get(entry)
+                    connection = connect(params.model_server_socket)
                     logger.info("Model server is up and running")
-                    break
-                except ConnectionError:
+                    return connection
+                except (FileNotFoundError, ConnectionRefusedError):
                     time.sleep(5)  # seconds
                     attempts += 1
 
-        if response is None:
-            raise RuntimeError("Could not connect to model server")
+        raise RuntimeError("Could not connect to model server")
+
+    def _query_server(self, entries):
+        queries = [[int(entry["iid"]), entry["name"], entry["kind"]]
+                   for entry in entries]
+        try:
+            return self._send_queries(queries)
+        except (BrokenPipeError, ConnectionResetError):
+            # e.g., the model server got restarted; reconnect once
+            logger.info("Lost the connection to the model server. Reconnecting")
+            return self._send_queries(queries)
+
+    def _send_queries(self, queries):
+        # reuse one connection for all queries of this process
+        if self.connection is None:
+            self.connection = self._connect()
+
+        try:
+            send_frame(self.connection, queries)
+            predicted_values = recv_frame(self.connection)
+            if predicted_values is None:
+                raise ConnectionResetError("Model server closed the connection")
+        except OSError:
+            self.connection.close()
+            self.connection = None
+            raise
+        return predicted_values
 
-        val_as_string = response["v"]
+    def _query_model(self, entry):
+        key = (int(entry["iid"]), entry["kind"], entry["name"])
+        if key in self.prefetched:
+            val_as_string = self.prefetched[key]
+            return val_as_string, restore_value(val_as_string)
+
+        if self.cache is not None:
+            val_as_string = self.cache.get(*key)
+            if val_as_string is not None:
+                return val_as_string, restore_value(val_as_string)
+
+        val_as_string = self._query_server([entry])[0]
+        if val_as_string is None:
+            raise RuntimeError(f"Model server could not predict {entry}")
         val = restore_value(val_as_string)
 
+        if self.cache is not None:
+            self.cache.put(*key, val_as_string)
+
         return val_as_string, val
 
+    def prefetch(self, file):
+        # predict values for all names, calls, and attributes of the file
+        # in a few batched queries, before the file starts to execute
+        entries = gather_entries(file, IIDs(params.iids_file))
+        if self.cache is not None:
+            entries = [e for e in entries if self.cache.get(
+                e["iid"], e["kind"], e["name"]) is None]
+        if len(entries) == 0:
+            return
+
+        logger.info(f"Prefetching predictions for {len(entries)} entries")
+        try:
+            predicted_values = self._query_server(entries)
+        except (RuntimeError, OSError) as e:
+            logger.info(f"Prefetching failed, will query lazily instead: {e}")
+            return
+
+        for entry, val_as_string in zip(entries, predicted_values):
+            if val_as_string is None:
+                continue  # entry couldn't be encoded by the model server
+            key = (entry["iid"], entry["kind"], entry["name"])
+            self.prefetched[key] = val_as_string
+            if self.cache is not None:
+                self.cache.put(*key, val_as_string)
+
     def name(self, iid, name):
         entry = {"iid": iid, "name": name, "kind": "name"}
         abstract_v, v = self._query_model(entry)
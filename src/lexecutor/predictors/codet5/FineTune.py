@@ -5,19 +5,21 @@ import torch as t
 import csv
 import pandas as pd
 import numpy as np
-from torch.utils.data import DataLoader, TensorDataset
 from transformers import AdamW
 from .CodeT5 import load_CodeT5
+from .CandidateScorer import CandidateScorer
+from .InferenceBackend import PyTorchBackend
 from ...Hyperparams import Hyperparams as params
 from ..DLUtil import device
+from ..ShardedTensors import length_bucketed_loader
 from ...Logging import logger
 
 
 parser = argparse.ArgumentParser()
 parser.add_argument(
-    "--train_tensors", help=".pt files for training", default="train.pt")
+    "--train_tensors", help=".pt file or .manifest.json file of sharded tensors for training", default="train.pt")
 parser.add_argument(
-    "--validate_tensors", help=".pt files for validation", default="validate.pt")
+    "--validate_tensors", help=".pt file or .manifest.json file of sharded tensors for validation", default="validate.pt")
 parser.add_argument(
     "--output_dir", help="directory to store models", required=True)
 parser.add_argument(
@@ -28,12 +30,12 @@ print_examples = True
 
 
 def evaluate(validate_tensors_path, model, tokenizer):
-    validate_dataset = TensorDataset(t.load(validate_tensors_path))
-    validate_loader = DataLoader(
-        validate_dataset, batch_size=params.batch_size_CodeT5, drop_last=True)
+    validate_loader = length_bucketed_loader(
+        validate_tensors_path, params.batch_size_CodeT5, tokenizer.pad_token_id)
 
     logger.info("Starting evaluation")
-    logger.info("  Num examples = {}".format(len(validate_dataset)))
+    logger.info("  Num examples = {}".format(
+        len(validate_loader) * params.batch_size_CodeT5))
     logger.info("  Num batches = {}".format(len(validate_loader)))
     logger.info("  Batch size = {}".format(params.batch_size_CodeT5))
 
@@ -42,64 +44,46 @@ def evaluate(validate_tensors_path, model, tokenizer):
     all_inputs = []
     all_labels = []
     all_predictions = []
+    all_confidences = []
+    scorer = CandidateScorer(PyTorchBackend(model), tokenizer)
 
     with t.no_grad():
         model.eval()
 
-        for batch_idx, batch in enumerate(validate_loader):
-            batch = t.cat(batch)
-            input_ids = batch[:, 0:512]
+        for batch_idx, (input_ids, attention_mask, label_ids) in enumerate(validate_loader):
             input_ids = input_ids.to(device)
-            label_ids = batch[:, 512:518]
+            attention_mask = attention_mask.to(device)
+            label_ids = label_ids[:, 0:params.nb_trained_label_ids]
             label_ids = label_ids.to(device)
 
             labels = tokenizer.batch_decode(
                 label_ids, skip_special_tokens=True)
 
-            # combine top-most prediction obtained via normal sampling and top-2, top-3, etc. predictions obtained via top-p nucleus sampling
-            # 1) top-most prediction obtained via normal sampling
-            generated_ids = model.generate(
-                input_ids, max_length=params.max_output_length)
-            predictions = tokenizer.batch_decode(
-                generated_ids, skip_special_tokens=True)
-
-            corrects = [1 for i in range(
-                len(labels)) if labels[i] == predictions[i]]
-            top1_accuracy = float(len(corrects)) / len(labels)
-            k_to_all_accuracies[1].append(top1_accuracy)
+            # rank all candidate values with one encoder and one decoder pass
+            topk_predictions = scorer.top_k(input_ids, attention_mask, k_max)
+            predictions = [topk[0][0] for topk in topk_predictions]
+            confidences = [topk[0][1] for topk in topk_predictions]
 
             # for debugging/eye-balling the results
             all_inputs.extend(tokenizer.batch_decode(
                 input_ids, skip_special_tokens=False))
             all_labels.extend(labels)
             all_predictions.extend(predictions)
+            all_confidences.extend(confidences)
             if print_examples:
                 for label_idx, label in enumerate(labels):
                     if random.uniform(0, 100) < 0.1:
                         prediction = predictions[label_idx]
                         logger.info(
-                            f"Label: {label}, Prediction: {prediction}")
-
-            # 2) top-2, top-3, etc. predictions obtained via top-p nucleus sampling (see https://huggingface.co/blog/how-to-generate)
-            topk_generated_ids = model.generate(
-                input_ids, max_length=params.max_output_length,
-                do_sample=True, top_k=k_max, top_p=0.95, num_return_sequences=k_max)
-            topk_predictions = tokenizer.batch_decode(
-                topk_generated_ids, skip_special_tokens=True)
+                            f"Label: {label}, Prediction: {prediction}, Confidence: {round(confidences[label_idx], 4)}")
 
             # count correct predictions among different top-k
             k_to_corrects = {k: 0 for k in range(1, k_max+1)}
-            # for top-1, use regular predictions from above
-            k_to_corrects[1] = len(corrects)
-            i = 0
-            while i < len(topk_predictions):
-                topk_predictions_for_example = topk_predictions[i:i+k_max]
-                example_idx = int(i / k_max)
-                label_for_example = labels[example_idx]
-                for k in range(2, k_max+1):
-                    if label_for_example in topk_predictions_for_example[:k]:
+            for label, topk in zip(labels, topk_predictions):
+                topk_values = [value for value, _ in topk]
+                for k in range(1, k_max+1):
+                    if label in topk_values[:k]:
                         k_to_corrects[k] += 1
-                i += k_max
 
             # compute top-k accuracies
             for k, corrects in k_to_corrects.items():
@@ -114,7 +98,8 @@ def evaluate(validate_tensors_path, model, tokenizer):
     # for debugging
     logger.info("Storing examples in human-readable format")
     examples_df = pd.DataFrame(
-        {"input": all_inputs, "label": all_labels, "prediction": all_predictions})
+        {"input": all_inputs, "label": all_labels, "prediction": all_predictions,
+         "confidence": all_confidences})
     examples_df.to_pickle("./eval_examples.pkl")
 
     logger.info("Done with evaluation")
@@ -134,17 +119,17 @@ if __name__ == "__main__":
 
     tokenizer, model = load_CodeT5()
 
-    train_dataset = TensorDataset(t.load(args.train_tensors))
-    train_loader = DataLoader(
-        train_dataset, batch_size=params.batch_size_CodeT5, drop_last=True)
+    train_loader = length_bucketed_loader(
+        args.train_tensors, params.batch_size_CodeT5, tokenizer.pad_token_id, shuffle=True)
+    train_dataset = train_loader.dataset
 
     optim = AdamW(model.parameters(), lr=1e-5)
 
     logger.info(f"Starting training on {device}")
-    logger.info("  Num examples = {}".format(len(train_dataset)))
+    logger.info("  Num examples = {}".format(
+        len(train_loader) * params.batch_size_CodeT5))
     logger.info("  Batch size = {}".format(params.batch_size_CodeT5))
-    logger.info("  Batch num = {}".format(
-        len(train_dataset) / params.batch_size_CodeT5))
+    logger.info("  Batch num = {}".format(len(train_loader)))
     logger.info("  Num epoch = {}".format(params.epochs))
 
     if not os.path.exists(args.output_dir):
@@ -155,18 +140,19 @@ if __name__ == "__main__":
 
     for epoch in range(params.epochs):
         logger.info(f"Epoch {epoch}")
+        if hasattr(train_dataset, "set_epoch"):
+            train_dataset.set_epoch(epoch)
 
-        for batch_idx, batch in enumerate(train_loader):
-            batch = t.cat(batch)
-            input_ids = batch[:, 0:512]
+        for batch_idx, (input_ids, attention_mask, labels) in enumerate(train_loader):
             input_ids = input_ids.to(device)
-            labels = batch[:, 512:518]
+            attention_mask = attention_mask.to(device)
+            labels = labels[:, 0:params.nb_trained_label_ids]
             labels = labels.to(device)
 
             model.train()
             optim.zero_grad()
 
-            outputs = model(input_ids, labels=labels)
+            outputs = model(input_ids, attention_mask=attention_mask, labels=labels)
 
             loss = outputs.loss
             loss.backward()
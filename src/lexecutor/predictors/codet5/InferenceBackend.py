@@ -0,0 +1,138 @@
+import os
+from os import path
+import torch as t
+from ..DLUtil import device
+from ...Logging import logger
+
+
+# Backends that run CodeT5's encoder and decoder for the CandidateScorer:
+#  - pytorch: the fp32 model as loaded
+#  - pytorch-int8: the model with dynamically quantized int8 linear layers (CPU only)
+#  - onnx, onnx-int8: encoder and decoder exported as ONNX graphs (the
+#    latter with int8 weights) and run with ONNX Runtime (CPU only), which
+#    is an optional dependency: pip install onnxruntime
+backends = ["pytorch", "pytorch-int8", "onnx", "onnx-int8"]
+
+
+class _Encoder(t.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        return self.model.get_encoder()(
+            input_ids=input_ids, attention_mask=attention_mask).last_hidden_state
+
+
+class _Decoder(t.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, decoder_input_ids, encoder_states, attention_mask):
+        # the logits of the next token at each position of decoder_input_ids
+        return self.model(encoder_outputs=(encoder_states,), attention_mask=attention_mask,
+                          decoder_input_ids=decoder_input_ids, use_cache=False).logits
+
+
+class PyTorchBackend:
+    def __init__(self, model, quantize=False):
+        if quantize:
+            model = t.quantization.quantize_dynamic(
+                model.to("cpu"), {t.nn.Linear}, dtype=t.qint8)
+        self.device = "cpu" if quantize else device
+        self.decoder_start_token_id = model.config.decoder_start_token_id
+        self.encode = _Encoder(model)
+        self.decode = _Decoder(model)
+
+
+def export_onnx(model, export_dir, quantize=False):
+    # Exports the encoder and the decoder (with dynamic batch and sequence
+    # sizes) into export_dir, unless they were exported before, and returns
+    # the paths of both graphs.
+    suffix = "_int8" if quantize else ""
+    encoder_file = path.join(export_dir, f"encoder{suffix}.onnx")
+    decoder_file = path.join(export_dir, f"decoder{suffix}.onnx")
+    if path.exists(encoder_file) and path.exists(decoder_file):
+        return encoder_file, decoder_file
+
+    os.makedirs(export_dir, exist_ok=True)
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        fp32_encoder_file, fp32_decoder_file = export_onnx(model, export_dir)
+        logger.info(f"Quantizing ONNX graphs in {export_dir}")
+        quantize_dynamic(fp32_encoder_file, encoder_file,
+                         weight_type=QuantType.QInt8)
+        quantize_dynamic(fp32_decoder_file, decoder_file,
+                         weight_type=QuantType.QInt8)
+        return encoder_file, decoder_file
+
+    logger.info(f"Exporting ONNX graphs to {export_dir}")
+    model = model.to("cpu").eval()
+    input_ids = t.ones((2, 16), dtype=t.long)
+    attention_mask = t.ones((2, 16), dtype=t.long)
+    decoder_input_ids = t.zeros((2, 4), dtype=t.long)
+    with t.no_grad():
+        encoder_states = _Encoder(model)(input_ids, attention_mask)
+        t.onnx.export(_Encoder(model), (input_ids, attention_mask), encoder_file,
+                      input_names=["input_ids", "attention_mask"],
+                      output_names=["encoder_states"],
+                      dynamic_axes={"input_ids": {0: "batch", 1: "sequence"},
+                                    "attention_mask": {0: "batch", 1: "sequence"},
+                                    "encoder_states": {0: "batch", 1: "sequence"}},
+                      opset_version=14)
+        t.onnx.export(_Decoder(model), (decoder_input_ids, encoder_states, attention_mask), decoder_file,
+                      input_names=["decoder_input_ids",
+                                   "encoder_states", "attention_mask"],
+                      output_names=["logits"],
+                      dynamic_axes={"decoder_input_ids": {0: "batch", 1: "labels"},
+                                    "encoder_states": {0: "batch", 1: "sequence"},
+                                    "attention_mask": {0: "batch", 1: "sequence"},
+                                    "logits": {0: "batch", 1: "labels"}},
+                      opset_version=14)
+    return encoder_file, decoder_file
+
+
+class OnnxBackend:
+    def __init__(self, model, export_dir, quantize=False):
+        import onnxruntime
+
+        encoder_file, decoder_file = export_onnx(model, export_dir, quantize)
+        self.encoder = onnxruntime.InferenceSession(
+            encoder_file, providers=["CPUExecutionProvider"])
+        self.decoder = onnxruntime.InferenceSession(
+            decoder_file, providers=["CPUExecutionProvider"])
+        self.device = "cpu"
+        self.decoder_start_token_id = model.config.decoder_start_token_id
+
+    def encode(self, input_ids, attention_mask):
+        return t.from_numpy(self.encoder.run(None, {"input_ids": input_ids.numpy(),
+                                                    "attention_mask": attention_mask.numpy()})[0])
+
+    def decode(self, decoder_input_ids, encoder_states, attention_mask):
+        return t.from_numpy(self.decoder.run(None, {"decoder_input_ids": decoder_input_ids.numpy(),
+                                                    "encoder_states": encoder_states.numpy(),
+                                                    "attention_mask": attention_mask.numpy()})[0])
+
+
+def export_dir_of(model_path):
+    # exported graphs are kept next to the model, in a directory named after
+    # the size and modification time of the model file, so that graphs
+    # exported from an older model with the same path aren't reused
+    stat = os.stat(model_path)
+    return f"{model_path}.{stat.st_size}-{stat.st_mtime_ns}.onnx"
+
+
+def load_backend(name, model, model_path):
+    # model has the weights stored at model_path
+    logger.info(f"Using the {name} backend for CodeT5")
+    if name == "pytorch":
+        return PyTorchBackend(model)
+    elif name == "pytorch-int8":
+        return PyTorchBackend(model, quantize=True)
+    elif name == "onnx":
+        return OnnxBackend(model, export_dir_of(model_path))
+    elif name == "onnx-int8":
+        return OnnxBackend(model, export_dir_of(model_path), quantize=True)
+    else:
+        raise ValueError(f"Unknown CodeT5 backend: {name}")
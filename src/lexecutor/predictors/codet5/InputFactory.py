@@ -1,10 +1,12 @@
 import itertools
 import json
 import re
+import numpy as np
 import torch as t
 from ..DLUtil import dtype, device
 from ...Logging import logger
 from ...Hyperparams import Hyperparams as params
+from ..TokenizedFiles import TokenizedFiles, context_window
 
 
 # special tokens already provided by the tokenizer
@@ -31,6 +33,14 @@ class InputFactory(object):
             kind_attribute_token, add_special_tokens=False, return_attention_mask=False).input_ids[0]
         self.sep_token_id = self.tokenizer(
             sep_token, add_special_tokens=False, return_attention_mask=False).input_ids[0]
+        self.mask_token_id = self.tokenizer.encode(mask_token)[1]
+        self.kind_to_token_id = {"name": self.kind_name_token_id,
+                                 "call": self.kind_call_token_id,
+                                 "attribute": self.kind_attribute_token_id}
+
+        # for the batch path
+        self.tokenized_files = TokenizedFiles(tokenizer)
+        self.value_to_label_ids = {}
 
     def __tokenize_lines(self, file_name):
         if file_name in self.file_to_tokenized_lines:
@@ -72,7 +82,7 @@ class InputFactory(object):
         return previous_target_tokens, after_target_tokens
 
 
-    def _encode_input(self, entry, location, lines, tokenized_lines):
+    def _encode_input(self, entry, location, lines, tokenized_lines, pad=True):
         # format of input:
         # name <sep> kind <sep> pre-context <mask> post-context
 
@@ -106,12 +116,10 @@ class InputFactory(object):
         while len(name_ids) + len(context_ids) + 5 > 512:
             context_ids = context_ids[1:-1]
 
-        if entry["kind"] == "name":
-            kind_token = self.kind_name_token_id
-        elif entry["kind"] == "call":
-            kind_token = self.kind_call_token_id
-        elif entry["kind"] == "attribute":
-            kind_token = self.kind_attribute_token_id
+        return self._assemble_input(name_ids, entry["kind"], context_ids, pad)
+
+    def _assemble_input(self, name_ids, kind, context_ids, pad=True):
+        kind_token = self.kind_to_token_id[kind]
 
         input_ids = [self.tokenizer.bos_token_id] + \
             name_ids + \
@@ -120,7 +128,7 @@ class InputFactory(object):
             [self.tokenizer.eos_token_id]
 
         # Add padding
-        if len(input_ids) < 512:
+        if pad and len(input_ids) < 512:
             input_ids = input_ids + \
                 (512 - len(input_ids)) * [self.tokenizer.pad_token_id]
 
@@ -136,21 +144,109 @@ class InputFactory(object):
             assert entry["value"].startswith("@"), entry["value"]
             value = entry["value"][1:]
 
+        return self._tokenize_value(value)
+
+    def _tokenize_value(self, value):
         label_ids = self.tokenizer(
             value, padding="max_length", max_length=params.max_output_length).input_ids
         return label_ids
 
-    def entry_to_inputs(self, entry):
-        location = self.iids.location(str(entry["iid"]))
+    def entry_to_inputs(self, entry, pad=True):
+        # without padding, the input ids have at most 512 tokens
+        location = self.iids.location(entry["iid"])
 
         lines, tokenized_lines = self.__tokenize_lines(location.file+'.orig')
 
-        input_ids = self._encode_input(entry, location, lines, tokenized_lines)
+        input_ids = self._encode_input(
+            entry, location, lines, tokenized_lines, pad)
         label_ids = self._encode_output(entry)
 
         input_ids = t.tensor(input_ids, device='cpu')
         label_ids = t.tensor(label_ids, device='cpu')
 
-        assert len(input_ids) == 512, len(input_ids)
+        assert len(input_ids) == 512 if pad else len(input_ids) <= 512, len(input_ids)
         assert len(label_ids) == params.max_output_length, len(label_ids)
         return input_ids, label_ids
+
+    def entries_to_inputs(self, entries, out, chunk_size=10000):
+        # Batch version of entry_to_inputs for a DataFrame of entries: writes
+        # the input ids and label ids of the i-th entry into out[i], a
+        # preallocated integer array of shape [len(entries), 512 + max_output_length].
+        for row, input_ids, label_ids in self._batch_inputs(entries, chunk_size):
+            out[row, :len(input_ids)] = input_ids
+            out[row, len(input_ids):512] = self.tokenizer.pad_token_id
+            out[row, 512:] = label_ids
+
+    def entries_to_unpadded_inputs(self, entries, chunk_size=10000):
+        # Like entries_to_inputs, but without padding: returns the ids of all
+        # entries as one flat int32 array, where the i-th entry's input ids,
+        # followed by its max_output_length label ids, are
+        # ids[offsets[i]:offsets[i+1]].
+        all_ids = [None] * len(entries)
+        for row, input_ids, label_ids in self._batch_inputs(entries, chunk_size):
+            all_ids[row] = input_ids + label_ids
+        offsets = np.zeros(len(all_ids) + 1, dtype=np.int64)
+        np.cumsum([len(ids) for ids in all_ids], out=offsets[1:])
+        ids = np.fromiter(itertools.chain(*all_ids),
+                          dtype=np.int32, count=offsets[-1])
+        return ids, offsets
+
+    def _batch_inputs(self, entries, chunk_size):
+        # Yields (row, unpadded input ids, label ids) for each entry of a
+        # DataFrame. Entries are processed file by file, so that each file is
+        # read, tokenized, and flattened once, and the modified target lines
+        # and the names of a chunk of entries are tokenized with one tokenizer
+        # call each.
+        names = entries["name"].tolist()
+        kinds = entries["kind"].tolist()
+        values = entries["value"].tolist() if "value" in entries else None
+        locations = [self.iids.location(iid) for iid in entries["iid"]]
+        rows = sorted(range(len(locations)), key=lambda row: locations[row].file)
+
+        for chunk_start in range(0, len(rows), chunk_size):
+            chunk_rows = rows[chunk_start:chunk_start + chunk_size]
+
+            modified_lines = []
+            for row in chunk_rows:
+                location = locations[row]
+                lines, _, _ = self.tokenized_files.get(location.file+'.orig')
+                target_line = lines[location.line-1]
+                modified_lines.append(target_line[:location.column_start] +
+                                      mask_token + target_line[location.column_end:])
+            tokenized_target_lines = self.tokenizer(
+                modified_lines, return_attention_mask=False, add_special_tokens=False).input_ids
+            all_name_ids = self.tokenizer([names[row] for row in chunk_rows],
+                                          return_attention_mask=False, add_special_tokens=False).input_ids
+
+            for row, tokenized_target_line, name_ids in zip(chunk_rows, tokenized_target_lines, all_name_ids):
+                location = locations[row]
+                _, token_ids, line_offsets = self.tokenized_files.get(
+                    location.file+'.orig')
+                previous_target_tokens, after_target_tokens = context_window(
+                    token_ids, line_offsets, location.line-1, tokenized_target_line,
+                    tokenized_target_line.index(self.mask_token_id))
+                context_ids = previous_target_tokens + after_target_tokens
+
+                # shrink context to fit everything (incl. the variable-sized name_ids) into 512 tokens
+                while len(name_ids) + len(context_ids) + 5 > 512:
+                    context_ids = context_ids[1:-1]
+
+                yield row, self._assemble_input(name_ids, kinds[row], context_ids, pad=False), \
+                    self._label_ids(values[row] if values is not None else None)
+
+            logger.info(
+                f"Vectorized {min(chunk_start + chunk_size, len(rows))}/{len(rows)} entries")
+
+    def _label_ids(self, value):
+        # like _encode_output, but each distinct value is tokenized only once
+        label_ids = self.value_to_label_ids.get(value)
+        if label_ids is None:
+            if value is None:
+                # during prediction
+                label_ids = self._tokenize_value("unknown")
+            else:
+                # during training
+                assert value.startswith("@"), value
+                label_ids = self._tokenize_value(value[1:])
+            self.value_to_label_ids[value] = label_ids
+        return label_ids
@@ -1,23 +1,57 @@
+import argparse
+import atexit
+import os
+from os import path
 from pathlib import Path
+import socketserver
+import threading
 import torch as t
-import numpy as np
 from flask import Flask, json, request
 import requests
-from ..DLUtil import device
+from ..DLUtil import device, pad_and_mask
 from ...Hyperparams import Hyperparams as params
 from ...IIDs import IIDs
 from .FineTune import load_CodeT5
 from .InputFactory import InputFactory
+from .CandidateScorer import CandidateScorer
+from .InferenceBackend import backends, load_backend
+from .Transport import connect, send_frame, recv_frame
+from .BatchScheduler import BatchScheduler
 from ...Logging import logger
 import logging
 
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "--http", help="Additionally serve the legacy HTTP endpoints at localhost:5000 (e.g., for benchmarking)", action="store_true")
+parser.add_argument(
+    "--batch_window_ms", help="Time to wait for concurrent queries to join a batch", type=float, default=params.batch_window_ms)
+parser.add_argument(
+    "--batch_max_items", help="Maximum number of entries per batch", type=int, default=params.batch_max_items)
+parser.add_argument(
+    "--backend", help="How to run the model (the -int8 backends quantize it; the onnx backends require onnxruntime)",
+    choices=backends, default=params.codet5_backend)
+
 # TODO auto-kill the server after some time of inactivity
 
 
+def get_model_path():
+    if params.value_abstraction == "fine-grained":
+        return "data/released_models/codet5_model_20230105_fine-grained.bin"
+    elif params.value_abstraction == "coarse-grained-deterministic" or params.value_abstraction == "coarse-grained-randomized":
+        return "data/released_models/codet5_model_20230105_coarse-grained.bin"
+
+
 class ModelServer:
-    def __init__(self):
-        self._initialize_model()
-        self._initialize_http_server()
+    def __init__(self, http=False, batch_window_ms=params.batch_window_ms, batch_max_items=params.batch_max_items,
+                 backend=params.codet5_backend):
+        self._initialize_model(backend)
+        self.scheduler = BatchScheduler(
+            self.predict, batch_window_ms, batch_max_items)
+        atexit.register(self.scheduler.report)
+        if http:
+            threading.Thread(
+                target=self._initialize_http_server, daemon=True).start()
+        self._initialize_socket_server()
 
     def _fetch_model(self, model_path):
         path_to_url = {
@@ -31,21 +65,56 @@ class ModelServer:
         request = requests.get(path_to_url[model_path], allow_redirects=True)
         open(model_path, 'wb').write(request.content)        
 
-    def _initialize_model(self):
+    def _initialize_model(self, backend):
         logger.info("Loading CodeT5 model")
         self.tokenizer, self.model = load_CodeT5()
 
-        if params.value_abstraction == "fine-grained":
-            model_path = "data/released_models/codet5_model_20230105_fine-grained.bin"
-        elif params.value_abstraction == "coarse-grained-deterministic" or params.value_abstraction == "coarse-grained-randomized":
-            model_path = "data/released_models/codet5_model_20230105_coarse-grained.bin"
+        model_path = get_model_path()
         self._fetch_model(model_path)
         self.model.load_state_dict(t.load(model_path, map_location=device))
 
         iids = IIDs(params.iids_file)
         self.input_factory = InputFactory(iids, self.tokenizer)
+        self.backend = load_backend(backend, self.model, model_path)
+        self.scorer = CandidateScorer(self.backend, self.tokenizer)
         logger.info("CodeT5 model loaded")
 
+    def predict(self, entries):
+        # turn queries into vectors (None for entries that can't be encoded)
+        all_input_ids = []
+        for entry in entries:
+            try:
+                input_ids, _ = self.input_factory.entry_to_inputs(
+                    entry, pad=False)
+                all_input_ids.append(input_ids)
+            except Exception as e:
+                logger.info(f"Cannot encode entry {entry}: {e}")
+                all_input_ids.append(None)
+        encodable_idxs = [idx for idx, input_ids in enumerate(
+            all_input_ids) if input_ids is not None]
+        # batch inputs of similar length, which are padded only up to the longest one
+        encodable_idxs.sort(key=lambda idx: len(all_input_ids[idx]))
+
+        # query the model in batches, taking the most likely candidate value
+        predicted_values = [None] * len(entries)
+        with t.no_grad():
+            self.model.eval()
+            for batch_start in range(0, len(encodable_idxs), params.batch_size_CodeT5):
+                batch_idxs = encodable_idxs[batch_start:batch_start +
+                                            params.batch_size_CodeT5]
+                input_ids, attention_mask = pad_and_mask(
+                    [all_input_ids[idx] for idx in batch_idxs], self.tokenizer.pad_token_id)
+                top_predictions = self.scorer.top_k(
+                    input_ids.to(self.backend.device), attention_mask.to(self.backend.device), 1)
+
+                for idx, [(predicted_value, probability)] in zip(batch_idxs, top_predictions):
+                    if params.verbose:
+                        print(
+                            f"CodeT5 predicts {predicted_value} with probability {round(probability, 4)}")
+                    predicted_values[idx] = predicted_value
+
+        return predicted_values
+
     def _initialize_http_server(self):
         logger.info("Starting HTTP server")
         api = Flask(__name__)
@@ -59,31 +128,61 @@ class ModelServer:
                      "name": request.args.get("name"),
                      "kind": request.args.get("kind")}
 
-            # turn query into vectors
-            input_ids, _ = self.input_factory.entry_to_inputs(entry)
-            input_ids = [tensor.cpu() for tensor in input_ids]
-
-            # query the model and decode the result
-            with t.no_grad():
-                self.model.eval()
-                generated_ids = self.model.generate(
-                    t.tensor(np.array([input_ids]), device=device), max_length=params.max_output_length)
-
-            predicted_value = self.tokenizer.decode(
-                generated_ids[0], skip_special_tokens=True)
-
-            if params.verbose:
-                if self.tokenizer.bos_token_id not in generated_ids or self.tokenizer.eos_token_id not in generated_ids[0]:
-                    print(
-                        f"Warning: CodeT5 likely produced a garbage value: {predicted_value}")
+            predicted_value = self.scheduler.submit([entry])[0]
+            if predicted_value is None:
+                return json.dumps({"v": None}), 500
 
             # respond with a JSON object
             result = {"v": predicted_value}
             return json.dumps(result)
 
+        @api.route('/query_batch', methods=['POST'])
+        def handle_query_batch():
+            entries = request.get_json()["entries"]
+            predicted_values = self.scheduler.submit(entries)
+            result = {"vs": predicted_values}
+            return json.dumps(result)
+
         api.run()
 
+    def _initialize_socket_server(self):
+        model_server = self
+
+        class QueryHandler(socketserver.BaseRequestHandler):
+            # serves all queries of one client over its persistent connection
+            def handle(self):
+                while True:
+                    queries = recv_frame(self.request)
+                    if queries is None:
+                        return  # client closed the connection
+                    entries = [{"iid": iid, "name": name, "kind": kind}
+                               for iid, name, kind in queries]
+                    try:
+                        predicted_values = model_server.scheduler.submit(
+                            entries)
+                    except Exception as e:
+                        logger.info(f"Error while predicting: {e}")
+                        predicted_values = [None] * len(entries)
+                    send_frame(self.request, predicted_values)
+
+        # remove a stale socket file left behind by a previous server, but
+        # not the socket of a server that is still running
+        if path.exists(params.model_server_socket):
+            try:
+                connect(params.model_server_socket).close()
+            except ConnectionRefusedError:
+                os.remove(params.model_server_socket)
+            else:
+                raise RuntimeError(
+                    f"A model server is already running at {params.model_server_socket}")
+
+        logger.info(f"Starting socket server at {params.model_server_socket}")
+        with socketserver.ThreadingUnixStreamServer(params.model_server_socket, QueryHandler) as socket_server:
+            socket_server.daemon_threads = True
+            socket_server.serve_forever()
 
 
 if __name__ == "__main__":
-    ModelServer()
+    args = parser.parse_args()
+    ModelServer(http=args.http, batch_window_ms=args.batch_window_ms,
+                batch_max_items=args.batch_max_items, backend=args.backend)
@@ -0,0 +1,47 @@
+import socket
+import struct
+import msgpack
+
+
+# Frames exchanged with the model server over a Unix domain socket:
+# a 4-byte big-endian length, followed by a msgpack-encoded payload.
+# Requests are lists of [iid, name, kind], responses are lists of predicted values.
+header = struct.Struct(">I")
+
+
+def connect(socket_path):
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(socket_path)
+    except OSError:
+        connection.close()
+        raise
+    return connection
+
+
+def send_frame(connection, obj):
+    payload = msgpack.packb(obj, use_bin_type=True)
+    connection.sendall(header.pack(len(payload)) + payload)
+
+
+def _recv_exactly(connection, nb_bytes):
+    buffer = bytearray(nb_bytes)
+    view = memoryview(buffer)
+    received = 0
+    while received < nb_bytes:
+        nb_received = connection.recv_into(view[received:], nb_bytes - received)
+        if nb_received == 0:
+            return None  # connection closed by the other side
+        received += nb_received
+    return buffer
+
+
+def recv_frame(connection):
+    raw_header = _recv_exactly(connection, header.size)
+    if raw_header is None:
+        return None
+    (length,) = header.unpack(raw_header)
+    payload = _recv_exactly(connection, length)
+    if payload is None:
+        return None
+    return msgpack.unpackb(payload, raw=False)